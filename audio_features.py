@@ -0,0 +1,131 @@
+import numpy as np
+
+from visualization import VALUE_RANGE
+
+# Offset added to the mel spectrogram (in dB, 0 at the loudest bin) to get bar values
+BAR_DB_OFFSET = 40.0
+
+# Number of mel (or video) frames processed at a time by the block-wise functions
+BLOCK_FRAMES = 8192
+
+# Dynamic range of the mel spectrogram in dB, as in librosa.power_to_db
+TOP_DB = 80.0
+AMIN = 1e-10
+
+
+def compute_mel_db(y, sr, n_fft, hop_length, n_mels):
+    """
+    Compute the mel spectrogram in dB (n_mels x n_frames) of the whole signal in memory.
+    """
+    import librosa
+
+    D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
+    mag, _ = librosa.magphase(D)
+    mel = librosa.feature.melspectrogram(S=mag, sr=sr, n_mels=n_mels)
+    return librosa.power_to_db(mel, ref=np.max)
+
+
+def compute_mel_db_streaming(y, sr, n_fft, hop_length, n_mels, path, block_frames=BLOCK_FRAMES):
+    """
+    Compute the same mel spectrogram as compute_mel_db in bounded memory.
+
+    `y` is read in blocks of `block_frames` STFT frames (with the n_fft - hop_length samples
+    of overlap each block needs), and the mel frames of each block are written to an
+    on-disk .npy array at `path`. The running maximum collected on the way is the
+    reference for the dB conversion, which is done in a second pass over the array.
+    Returns the array as a memmap, transposed to n_mels x n_frames.
+    """
+    import librosa
+
+    n_frames = 1 + len(y) // hop_length
+    pad = n_fft // 2
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels).astype(np.float32)
+    mel = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n_frames, n_mels))
+
+    peak = 0.0
+    for first in range(0, n_frames, block_frames):
+        last = min(first + block_frames, n_frames)
+        # Samples covered by frames [first, last) of the centered (zero padded) STFT
+        start = first * hop_length - pad
+        end = (last - 1) * hop_length - pad + n_fft
+        block = np.zeros(end - start, dtype=np.float32)
+        block[max(-start, 0):min(len(y), end) - start] = y[max(start, 0):min(len(y), end)]
+
+        mag = np.abs(librosa.stft(block, n_fft=n_fft, hop_length=hop_length, center=False))
+        frames = (mel_basis @ mag).T
+        mel[first:last] = frames
+        peak = max(peak, float(frames.max()))
+
+    ref_db = 10 * np.log10(max(AMIN, peak))
+    for first in range(0, n_frames, block_frames):
+        frames = mel[first:first + block_frames]
+        db = 10 * np.log10(np.maximum(AMIN, frames)) - ref_db
+        # The loudest frame is at 0 dB, so the top_db floor is simply -TOP_DB
+        mel[first:first + block_frames] = np.maximum(db, -TOP_DB)
+    mel.flush()
+    return mel.T
+
+
+def frame_count(duration, fps):
+    """
+    Return the number of video frames needed to cover `duration` seconds at `fps`.
+    """
+    return max(int(np.ceil(duration * fps - 1e-9)), 1)
+
+
+def bar_heights_from_mel(mel_db, sr, hop_length, fps, n_frames, smoothing=0.0, start_frame=0, mel_offset=0):
+    """
+    Resample a mel spectrogram (n_mels x n_mel_frames, in dB) to one row of bar values per
+    video frame.
+
+    Returns a dense float32 matrix of shape (n_frames, n_mels) holding the bar value of
+    each bar at video frame k (time k / fps), clipped to the visualization value range.
+    Mel frames are linearly interpolated to the video frame times. If `smoothing` is
+    greater than zero, a moving average of that many seconds is applied along time.
+    `mel_db` may be an on-disk memmap; it is read in blocks of video frames. With
+    `start_frame` the rows are video frames start_frame to start_frame + n_frames - 1.
+    With `mel_offset` the spectrogram covers only a span of the recording, starting at its
+    mel frame mel_offset.
+    """
+    n_mels, n_mel_frames = mel_db.shape
+    heights = np.empty((n_frames, n_mels), dtype=np.float32)
+    if n_mel_frames == 0:
+        heights.fill(VALUE_RANGE[0])
+        return heights
+
+    mel_frames = mel_db.T
+    for first in range(0, n_frames, BLOCK_FRAMES):
+        last = min(first + BLOCK_FRAMES, n_frames)
+        # Position of every video frame on the mel frame axis
+        position = np.arange(start_frame + first, start_frame + last, dtype=np.float64) * (sr / hop_length / fps)
+        position = np.clip(position - mel_offset, 0, n_mel_frames - 1)
+        lower = position.astype(np.intp)
+        upper = np.minimum(lower + 1, n_mel_frames - 1)
+        weight = (position - lower).astype(np.float32)[:, None]
+
+        # Only the span of mel frames used by this block is read
+        span_start, span_end = lower[0], upper[-1] + 1
+        frames = np.asarray(mel_frames[span_start:span_end], dtype=np.float32)
+        block = heights[first:last]
+        np.multiply(frames[lower - span_start], 1 - weight, out=block)
+        block += frames[upper - span_start] * weight
+
+    window = int(round(smoothing * fps))
+    if window > 1:
+        heights = moving_average(heights, window)
+
+    heights += np.float32(BAR_DB_OFFSET)
+    np.clip(heights, VALUE_RANGE[0], VALUE_RANGE[1], out=heights)
+    return heights
+
+
+def moving_average(frames, window):
+    """
+    Centered moving average of `window` rows along the first axis, shrinking at the edges.
+    """
+    cumsum = np.zeros((len(frames) + 1, frames.shape[1]), dtype=np.float64)
+    np.cumsum(frames, axis=0, out=cumsum[1:])
+    index = np.arange(len(frames))
+    start = np.maximum(index - window // 2, 0)
+    end = np.minimum(start + window, len(frames))
+    return ((cumsum[end] - cumsum[start]) / (end - start)[:, None]).astype(np.float32)
@@ -0,0 +1,161 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from ffmpeg_utils import run_ffmpeg
+
+# Sample rate and channel count of the decoded PCM used for muxing (same as AudioFileClip)
+MUX_SAMPLE_RATE = 44100
+MUX_CHANNELS = 2
+
+# Number of samples processed at a time when deriving the analysis signal
+BLOCK_SIZE = 1 << 20
+
+
+def window_args(start=0.0, duration=None):
+    """
+    Return the ffmpeg input options that restrict the next input to a time window.
+    """
+    args = ['-ss', f'{start:.6f}'] if start else []
+    if duration is not None:
+        args += ['-t', f'{duration:.6f}']
+    return args
+
+
+class DecodedAudio:
+    """
+    An audio file decoded once into a memory-mapped float32 PCM file.
+
+    The same buffer feeds the analysis (a mono signal resampled to the analysis rate,
+    derived from it on first use) and the final mux, so the input is never decoded twice.
+    Call close() (or use it as a context manager) to remove the temporary files.
+
+    When only a span of the file was decoded, `offset` is the time in the file (in seconds)
+    of the first sample; the times passed to ffmpeg_input_args are still file times.
+    """
+
+    def __init__(self, source_path, workdir, sample_rate=MUX_SAMPLE_RATE, channels=MUX_CHANNELS, offset=0.0):
+        self.source_path = source_path
+        self.offset = offset
+        self.workdir = workdir
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.pcm_path = os.path.join(workdir, 'audio.f32')
+        self._analysis = {}
+
+        n_samples = os.path.getsize(self.pcm_path) // (4 * channels)
+        if n_samples == 0:
+            at = f" after {offset:.2f}s" if offset else ""
+            raise ValueError(f"No audio samples decoded from: {source_path}{at}")
+        self.samples = np.memmap(self.pcm_path, dtype=np.float32, mode='r', shape=(n_samples, channels))
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    def analysis_signal(self, sample_rate):
+        """
+        Return the mono signal at `sample_rate` as a read-only memmap.
+
+        The downmix and resampling run block by block over the PCM buffer with a streaming
+        resampler (the same soxr HQ filter librosa.load uses), so memory stays bounded.
+        """
+        if sample_rate in self._analysis:
+            return self._analysis[sample_rate]
+
+        import soxr
+
+        path = os.path.join(self.workdir, f'analysis-{sample_rate}.f32')
+        resampler = None
+        if sample_rate != self.sample_rate:
+            resampler = soxr.ResampleStream(self.sample_rate, sample_rate, 1, dtype='float32', quality='HQ')
+        with open(path, 'wb') as f:
+            for start in range(0, len(self.samples), BLOCK_SIZE):
+                block = self.samples[start:start + BLOCK_SIZE].mean(axis=1, dtype=np.float32)
+                if resampler is not None:
+                    last = start + BLOCK_SIZE >= len(self.samples)
+                    block = resampler.resample_chunk(block, last=last)
+                f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+
+        signal = np.memmap(path, dtype=np.float32, mode='r')
+        self._analysis[sample_rate] = signal
+        return signal
+
+    def to_audio_clip(self):
+        """
+        Return a moviepy audio clip reading from the decoded buffer.
+        """
+        from moviepy.audio.AudioClip import AudioArrayClip
+        return AudioArrayClip(self.samples, fps=self.sample_rate)
+
+    def ffmpeg_input_args(self, start=0.0, duration=None):
+        """
+        Return the ffmpeg arguments that read the decoded buffer (or `duration` seconds of it
+        from `start`) as an input.
+        """
+        return (window_args(start - self.offset, duration) +
+                ['-f', 'f32le', '-ar', str(self.sample_rate), '-ac', str(self.channels), '-i', self.pcm_path])
+
+    def close(self):
+        self._analysis.clear()
+        self.samples = None
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AudioFileInput:
+    """
+    An audio file muxed straight from disk, without decoding it in Python.
+
+    Used when the analysis of the file is already cached, so the only consumer of the
+    audio is the final mux. Offers the same muxing interface as DecodedAudio.
+    """
+
+    offset = 0.0
+
+    def __init__(self, source_path, duration):
+        self.source_path = source_path
+        self.duration = duration
+
+    def to_audio_clip(self):
+        from moviepy.editor import AudioFileClip
+        return AudioFileClip(self.source_path)
+
+    def ffmpeg_input_args(self, start=0.0, duration=None):
+        return window_args(start, duration) + ['-i', self.source_path]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def decode_audio(audio_path, sample_rate=MUX_SAMPLE_RATE, channels=MUX_CHANNELS, workdir=None, start=0.0, duration=None):
+    """
+    Decode an audio file with ffmpeg into a float32 PCM file and return it as DecodedAudio.
+
+    With `start` and `duration` (seconds, None for the rest of the file) only that span is
+    decoded: ffmpeg seeks to it in the input, so the cost does not depend on the file length.
+    """
+    created = workdir is None
+    if created:
+        workdir = tempfile.mkdtemp(prefix='podcast-maker-')
+    try:
+        run_ffmpeg(window_args(start, duration) + ['-i', audio_path, '-vn', '-f', 'f32le', '-acodec', 'pcm_f32le',
+                    '-ar', str(sample_rate), '-ac', str(channels), os.path.join(workdir, 'audio.f32')])
+        return DecodedAudio(audio_path, workdir, sample_rate, channels, offset=start)
+    except Exception:
+        if created:
+            shutil.rmtree(workdir, ignore_errors=True)
+        raise
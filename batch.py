@@ -0,0 +1,235 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Fields of a manifest job, in generate_video's argument order, with their defaults
+JOB_FIELDS = {
+    'audio_path': None,
+    'image_path': None,
+    'heading_text': None,
+    'font': 'Arial',
+    'heading_color': '#FFFFFF',
+    'outline_color': '#000000',
+    'wave_color': '#FF0000',
+    'output_path': None,
+}
+REQUIRED_FIELDS = ('audio_path', 'image_path', 'heading_text', 'output_path')
+
+# Optional generate_video arguments of a manifest job. Variants are a list (in CSV a
+# space-separated string) of "RESOLUTION:PATH[:OPTION=VALUE...]" specs or variant objects,
+# windows a list (in CSV a space-separated string) of "START-END" specs or [start, end] pairs.
+MANIFEST_OPTIONS = ('resolution', 'variants', 'windows')
+
+# Number of log lines kept in the result of a job
+LOG_TAIL = 20
+
+
+def load_manifest(path):
+    """
+    Load the jobs of a batch manifest.
+
+    A JSON manifest is a list of job objects (or an object with a "jobs" list); a CSV
+    manifest has one job per row with the field names in the header. Relative paths are
+    resolved against the manifest's directory. Returns a list of job dicts with defaults filled in.
+    """
+    with open(path, newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = json.load(f)
+            if isinstance(rows, dict):
+                rows = rows.get('jobs', [])
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for index, row in enumerate(rows):
+        try:
+            jobs.append(make_job(row, base_dir, MANIFEST_OPTIONS))
+        except ValueError as e:
+            raise ValueError(f"Job {index}: {e}")
+    return jobs
+
+
+def make_job(row, base_dir, options=()):
+    """
+    Check the fields of one job and return them with defaults filled in and the paths
+    resolved against `base_dir`. `options` are further generate_video arguments the job may
+    set; time windows are parsed to (start, end) pairs.
+    """
+    from video_generator import ENGINES
+
+    if not isinstance(row, dict):
+        raise ValueError("a job must be an object")
+    unknown = set(row) - set(JOB_FIELDS) - set(options)
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(sorted(unknown))}")
+    job = {field: row.get(field) or default for field, default in JOB_FIELDS.items()}
+    for field in JOB_FIELDS:
+        if job[field] is not None and not isinstance(job[field], str):
+            raise ValueError(f"{field} must be a string")
+    missing = [field for field in REQUIRED_FIELDS if not job[field]]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    for field in ('audio_path', 'image_path', 'output_path'):
+        job[field] = os.path.join(base_dir, os.path.expanduser(job[field]))
+    # Empty CSV cells leave an option unset
+    job.update((option, row[option]) for option in options if row.get(option) not in (None, ''))
+    for option in ('draft', 'resume'):
+        if option in job and not isinstance(job[option], bool):
+            raise ValueError(f"{option} must be true or false")
+    if 'engine' in job and job['engine'] not in ENGINES:
+        raise ValueError(f"engine must be one of {', '.join(ENGINES)}")
+    if 'window' in job:
+        job['window'] = parse_job_window(job['window'])
+    if 'variants' in job:
+        variants = job['variants'].split() if isinstance(job['variants'], str) else job['variants']
+        if not isinstance(variants, list):
+            raise ValueError("variants must be a list")
+        job['variants'] = [resolve_variant(variant, base_dir) for variant in variants]
+    if 'windows' in job:
+        if isinstance(job['windows'], str):
+            job['windows'] = job['windows'].split()
+        if not isinstance(job['windows'], list):
+            raise ValueError("windows must be a list")
+        job['windows'] = [parse_job_window(window) for window in job['windows']]
+    return job
+
+
+def parse_job_window(value):
+    """
+    Return the time window of a job, a "START-END" string or [start, end] pair, as (start, end) seconds.
+    """
+    from video_generator import parse_window
+
+    if isinstance(value, str):
+        window = parse_window(value)
+    elif isinstance(value, (list, tuple)) and len(value) == 2 and all(
+            isinstance(time, (int, float)) and not isinstance(time, bool) for time in value):
+        window = tuple(float(time) for time in value)
+    else:
+        raise ValueError(f"Invalid time window: {value} (use \"START-END\" or [start, end])")
+    if window[0] < 0 or window[1] <= window[0]:
+        raise ValueError(f"Invalid time window: {value} (the end must come after the start)")
+    return window
+
+
+def resolve_variant(variant, base_dir):
+    """
+    Return an output variant (spec string or object) with its output path resolved against `base_dir`.
+    """
+    if isinstance(variant, dict):
+        if not isinstance(variant.get('output_path') or '', str):
+            raise ValueError("a variant's output_path must be a string")
+        if variant.get('output_path'):
+            variant = dict(variant, output_path=os.path.join(base_dir, os.path.expanduser(variant['output_path'])))
+        return variant
+    parts = str(variant).split(':')
+    if len(parts) > 1 and parts[1]:
+        parts[1] = os.path.join(base_dir, os.path.expanduser(parts[1]))
+    return ':'.join(parts)
+
+
+def warm_up_worker():
+    """
+    Pool initializer: pay the heavy imports once per worker instead of once per job.
+    """
+    import librosa  # noqa: F401
+    import moviepy.config  # noqa: F401
+    from PIL import Image, ImageDraw, ImageFont  # noqa: F401
+
+    import video_generator  # noqa: F401
+
+
+def run_job(index, job, cache=True):
+    """
+    Worker: render one job and return its result summary. Never raises.
+    """
+    import video_generator
+
+    log = []
+    start = time.perf_counter()
+    try:
+        options = {option: job[option] for option in MANIFEST_OPTIONS if option in job}
+        ok = video_generator.generate_video(*(job[field] for field in JOB_FIELDS), log_callback=log.append, cache=cache,
+                                            **options)
+    except Exception as e:
+        log.append(f"Error: {str(e)}")
+        ok = False
+    wall_time = time.perf_counter() - start
+
+    errors = [line for line in log if line.startswith("Error: ")]
+    outputs = []
+    if ok:
+        outputs = [{'path': path, 'size': os.path.getsize(path) if os.path.exists(path) else None}
+                   for path in video_generator.output_paths(job['output_path'], job.get('windows'), job.get('variants'))]
+    return {
+        'index': index,
+        'output_path': job['output_path'],
+        'status': 'ok' if ok else 'failed',
+        'error': errors[-1][len("Error: "):] if errors else None,
+        'wall_time': round(wall_time, 3),
+        'outputs': outputs,
+        'log': log[-LOG_TAIL:],
+    }
+
+
+def run_batch(jobs, workers=None, cache=True, log=print):
+    """
+    Run the jobs on a pool of `workers` warmed-up processes and return their results in job order.
+
+    A failing job only marks its own result as failed. If a worker process dies, the jobs
+    it took down with the pool are retried one at a time in fresh processes.
+    """
+    workers = max(min(workers or os.cpu_count() or 1, len(jobs)), 1)
+    results = [None] * len(jobs)
+    # Jobs sharing a background are submitted together, so a worker is likely to reuse it
+    order = sorted(range(len(jobs)), key=lambda i: jobs[i]['image_path'])
+
+    def record(result):
+        results[result['index']] = result
+        log(f"[{result['index'] + 1}/{len(jobs)}] {result['status']} {result['output_path']} "
+            f"({result['wall_time']:.1f}s)" + (f": {result['error']}" if result['error'] else ""))
+
+    broken = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up_worker) as executor:
+        futures = {index: executor.submit(run_job, index, jobs[index], cache) for index in order}
+        for index, future in futures.items():
+            try:
+                record(future.result())
+            except BrokenProcessPool:
+                broken.append(index)
+
+    for index in broken:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                record(executor.submit(run_job, index, jobs[index], cache).result())
+            except BrokenProcessPool:
+                record({'index': index, 'output_path': jobs[index]['output_path'], 'status': 'failed',
+                        'error': 'worker process died', 'wall_time': 0.0, 'outputs': [], 'log': []})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="video_generator.py batch", description="Render all jobs of a JSON or CSV manifest.")
+    parser.add_argument("manifest", help="JSON or CSV manifest with one job per entry (the generate_video fields)")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default: number of CPU cores)")
+    parser.add_argument("--summary", help="Where to write the JSON result summary (default: <manifest>.results.json)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the render cache")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    print(f"Rendering {len(jobs)} jobs from {args.manifest}")
+    start = time.perf_counter()
+    results = run_batch(jobs, args.workers, cache=not args.no_cache)
+
+    summary_path = args.summary or os.path.splitext(args.manifest)[0] + '.results.json'
+    failed = sum(result['status'] != 'ok' for result in results)
+    with open(summary_path, 'w') as f:
+        json.dump({'manifest': os.path.abspath(args.manifest), 'jobs': len(results), 'failed': failed,
+                   'wall_time': round(time.perf_counter() - start, 3), 'results': results}, f, indent=2)
+    print(f"{len(results) - failed} of {len(results)} jobs succeeded, summary written to {summary_path}")
+    return 1 if failed else 0
@@ -0,0 +1,310 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+AUDIO_FIXTURES = ('tone', 'noise', 'silence', 'speech')
+RESOLUTIONS = ((1280, 720), (1920, 1080), (3840, 2160))
+FIXTURE_SAMPLE_RATE = 44100
+
+# Stages timed on each audio fixture, and on each background resolution
+AUDIO_STAGES = ('decode', 'mel', 'visualization')
+FRAME_STAGES = ('text', 'compositing', 'encoding')
+
+
+def synthesize_audio(kind, duration, sample_rate=FIXTURE_SAMPLE_RATE, seed=0):
+    """
+    Return a synthetic mono float signal in [-1, 1]: a tone, white noise, silence or a
+    speech-like signal (band-limited noise with a syllable-rate envelope and pauses).
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    if kind == 'tone':
+        return 0.5 * np.sin(2 * np.pi * 440 * t) + 0.2 * np.sin(2 * np.pi * 1320 * t)
+    if kind == 'noise':
+        return 0.3 * rng.standard_normal(len(t))
+    if kind == 'silence':
+        return np.zeros(len(t))
+    if kind == 'speech':
+        # Noise shaped to the speech band with a moving average, modulated at ~4 syllables/s
+        noise = np.convolve(rng.standard_normal(len(t)), np.ones(8) / 8, mode='same')
+        envelope = np.clip(np.sin(2 * np.pi * 4 * t + rng.uniform(0, 2 * np.pi)), 0, None) ** 2
+        # Pauses between phrases
+        envelope *= (np.sin(2 * np.pi * 0.25 * t) > -0.5)
+        voiced = 0.3 * np.sin(2 * np.pi * 140 * t) * envelope
+        return np.clip(noise * envelope + voiced, -1, 1)
+    raise ValueError(f"Unknown audio fixture: {kind}")
+
+
+def write_wav(path, signal, sample_rate=FIXTURE_SAMPLE_RATE):
+    pcm = (np.clip(signal, -1, 1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(np.repeat(pcm[:, None], 2, axis=1).tobytes())
+
+
+def synthesize_background(size, seed=0):
+    """
+    Return an RGB gradient with some noise (so it does not compress to nothing) as a PIL image.
+    """
+    from PIL import Image
+
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    img = np.stack([40 + 120 * x + 0 * y, 60 + 100 * y + 0 * x, 120 - 60 * x * y], axis=-1)
+    img += rng.normal(0, 6, img.shape).astype(np.float32)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+
+
+def generate_fixtures(directory, duration, audio_kinds=AUDIO_FIXTURES, resolutions=RESOLUTIONS):
+    """
+    Write the audio and background fixtures into `directory` and return {name: path}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    fixtures = {}
+    for kind in audio_kinds:
+        path = os.path.join(directory, f'{kind}.wav')
+        write_wav(path, synthesize_audio(kind, duration))
+        fixtures[kind] = path
+    for size in resolutions:
+        name = f'{size[0]}x{size[1]}'
+        path = os.path.join(directory, f'background-{name}.png')
+        synthesize_background(size).save(path)
+        fixtures[name] = path
+    return fixtures
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def fixture_bar_heights(path):
+    """
+    Return the bar-height matrix of an audio fixture, as a render computes it.
+    """
+    import video_generator as vg
+    from audio_features import compute_mel_db
+    from audio_io import decode_audio
+
+    with decode_audio(path) as audio:
+        mel_db = compute_mel_db(audio.analysis_signal(vg.SAMPLE_RATE), vg.SAMPLE_RATE, vg.N_FFT, vg.HOP_LENGTH, vg.N_MELS)
+        return vg.bar_heights_for_video(mel_db, audio.duration)
+
+
+def measure(stage, fixture, fixtures, frames, backend='numpy', bar_heights=None):
+    """
+    Run one stage on one fixture and return its measurement. Runs in a fresh process.
+
+    `backend` is the visualization renderer of the visualization and compositing stages
+    (see visualization.make_bar_renderer), "matplotlib" to time the reference renderer.
+    The per-frame stages take the `bar_heights` they render from the caller, so the peak
+    memory of the process is that of the stage, not of an audio analysis.
+    """
+    import video_generator as vg
+    from audio_features import compute_mel_db
+    from audio_io import decode_audio
+    from frame_pipe import FFmpegFrameWriter, load_background
+
+    result = {'name': f'{stage}/{fixture}', 'stage': stage, 'fixture': fixture}
+
+    def heading_for(size):
+        return vg.render_text_image("Benchmark Episode 42", vg.DEFAULT_FONT_PATH, vg.HEADING_FONT_SIZE,
+                                    '#FFFFFF', '#000000', vg.HEADING_STROKE_WIDTH, size)
+
+    count = None
+    if stage == 'decode':
+        start = time.perf_counter()
+        audio = decode_audio(fixtures[fixture])
+        wall_time = time.perf_counter() - start
+        audio.close()
+    elif stage == 'mel':
+        with decode_audio(fixtures[fixture]) as audio:
+            start = time.perf_counter()
+            y = audio.analysis_signal(vg.SAMPLE_RATE)
+            compute_mel_db(y, vg.SAMPLE_RATE, vg.N_FFT, vg.HOP_LENGTH, vg.N_MELS)
+            wall_time = time.perf_counter() - start
+    elif stage == 'visualization':
+        renderer = vg.make_bar_renderer('#FF0000', vg.N_MELS, backend=backend)
+        vis = None
+        start = time.perf_counter()
+        for index in range(frames):
+            vis = renderer.render(bar_heights[index % len(bar_heights)], out=vis)
+        wall_time = time.perf_counter() - start
+        count = frames
+    elif stage == 'text':
+        size = load_background(fixtures[fixture]).shape[1::-1]
+        count = 10
+        start = time.perf_counter()
+        for _ in range(count):
+            heading_for(size)
+        wall_time = time.perf_counter() - start
+    elif stage in ('compositing', 'encoding'):
+        background = load_background(fixtures[fixture])
+        size = background.shape[1::-1]
+        renderer = vg.make_bar_renderer('#FF0000', vg.N_MELS, backend=backend if stage == 'compositing' else 'numpy')
+        compositor = vg.create_frame_compositor(background, heading_for(size), renderer)
+        if stage == 'compositing':
+            vis = None
+            start = time.perf_counter()
+            for index in range(frames):
+                vis = renderer.render(bar_heights[index % len(bar_heights)], out=vis)
+                compositor.compose(vis)
+            wall_time = time.perf_counter() - start
+        else:
+            # A few distinct composited frames, cycled, so only the encoder is timed
+            samples = [compositor.compose(renderer.render(bar_heights[(i * 37) % len(bar_heights)])).copy()
+                       for i in range(8)]
+            with tempfile.TemporaryDirectory() as workdir:
+                start = time.perf_counter()
+                with FFmpegFrameWriter(os.path.join(workdir, 'out.mp4'), size, vg.FPS, codec=vg.VIDEO_CODEC,
+                                       preset=vg.VIDEO_PRESET, bitrate=vg.VIDEO_BITRATE, crf=vg.VIDEO_CRF,
+                                       threads=vg.encoder_threads()) as writer:
+                    for index in range(frames):
+                        writer.write(samples[index % len(samples)])
+                wall_time = time.perf_counter() - start
+        count = frames
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    result['wall_time'] = round(wall_time, 4)
+    if count:
+        result['frames'] = count
+        result['fps'] = round(count / wall_time, 2) if wall_time > 0 else None
+    result['peak_rss_mb'] = peak_rss_mb()
+    result['peak_child_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(duration=10.0, frames=120, audio_kinds=AUDIO_FIXTURES, resolutions=RESOLUTIONS, log=print,
+                   backend='numpy'):
+    """
+    Generate the fixtures in a temporary directory, run every stage and return the report.
+    """
+    context = multiprocessing.get_context('spawn')
+    measurements = []
+    with tempfile.TemporaryDirectory(prefix='podcast-maker-bench-') as directory:
+        log("Generating fixtures...")
+        fixtures = generate_fixtures(directory, duration, audio_kinds, resolutions)
+        log("Analyzing the audio fixtures...")
+        # In a process of its own: a child starts with the peak RSS of the process it was
+        # started from, so the analysis must not grow this one
+        with context.Pool(1) as pool:
+            bar_heights = dict(zip(audio_kinds, pool.map(fixture_bar_heights, [fixtures[kind] for kind in audio_kinds])))
+        # The frame stages render the speech fixture's bars
+        frame_bars = bar_heights.get('speech', next(iter(bar_heights.values()), None))
+        plan = [(stage, kind, bar_heights[kind]) for kind in audio_kinds for stage in AUDIO_STAGES]
+        plan += [(stage, f'{w}x{h}', frame_bars) for (w, h) in resolutions for stage in FRAME_STAGES]
+        for stage, fixture, bars in plan:
+            with context.Pool(1) as pool:
+                result = pool.apply(measure, (stage, fixture, fixtures, frames, backend,
+                                              bars if stage in ('visualization', 'compositing', 'encoding') else None))
+            measurements.append(result)
+            rate = f", {result['fps']} fps" if result.get('fps') else ""
+            log(f"{result['name']}: {result['wall_time']:.3f}s{rate}, peak RSS {result['peak_rss_mb']} MB")
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'audio_duration': duration,
+            'frames': frames,
+            'backend': backend,
+        },
+        'measurements': measurements,
+    }
+
+
+def compare_reports(baseline, current, threshold=0.1):
+    """
+    Compare two reports measurement by measurement.
+
+    Time per unit of work (per frame where frames are counted) and peak RSS are compared;
+    a measurement regresses when either grows by more than `threshold` (a fraction).
+    Returns a list of rows (name, metric, old, new, relative change, regressed).
+    """
+    def unit_time(result):
+        return result['wall_time'] / result.get('frames', 1)
+
+    old = {result['name']: result for result in baseline['measurements']}
+    rows = []
+    for result in current['measurements']:
+        before = old.get(result['name'])
+        if before is None:
+            continue
+        for metric, value in (('time', unit_time), ('peak_rss_mb', lambda r: r['peak_rss_mb'])):
+            a, b = value(before), value(result)
+            change = (b - a) / a if a else 0.0
+            rows.append((result['name'], metric, a, b, change, change > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the video rendering pipeline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help="Run the benchmarks and write a JSON report")
+    run.add_argument('--output', default='benchmark-results.json', help="Where to write the report")
+    run.add_argument('--duration', type=float, default=10.0, help="Length of the audio fixtures in seconds")
+    run.add_argument('--frames', type=int, default=120, help="Frames rendered by the per-frame stages")
+    run.add_argument('--audio', default=','.join(AUDIO_FIXTURES), help="Comma separated audio fixtures")
+    run.add_argument('--resolutions', default=','.join(f'{w}x{h}' for w, h in RESOLUTIONS),
+                     help="Comma separated background resolutions, e.g. 1280x720,1920x1080")
+    run.add_argument('--backend', choices=('numpy', 'matplotlib'), default='numpy',
+                     help="Visualization renderer, matplotlib for the reference renderer (default: numpy)")
+
+    compare = subparsers.add_parser('compare', help="Compare two reports and flag regressions")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.1, help="Allowed relative slowdown (default: 0.1)")
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        resolutions = [tuple(int(v) for v in r.split('x')) for r in args.resolutions.split(',') if r]
+        report = run_benchmarks(args.duration, args.frames, [a for a in args.audio.split(',') if a], resolutions,
+                                backend=args.backend)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare_reports(baseline, current, args.threshold)
+    for name, metric, old, new, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<28} {metric:<12} {old:>12.5g} {new:>12.5g} {change:>+8.1%} {flag}")
+    regressions = sum(row[5] for row in rows)
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
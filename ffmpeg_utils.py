@@ -0,0 +1,43 @@
+import os
+import subprocess
+
+
+def ffmpeg_binary():
+    """
+    Return the ffmpeg executable moviepy is configured to use.
+    """
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+
+def run_ffmpeg(args):
+    """
+    Run ffmpeg with the given arguments, raising RuntimeError with its error output on failure.
+    """
+    cmd = [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-nostdin', '-y'] + list(args)
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+
+def concat_segments(segment_paths, output_path, audio_input_args=None, audio_codec='aac'):
+    """
+    Join video segments with ffmpeg's concat demuxer without re-encoding them.
+
+    If `audio_input_args` is given (ffmpeg arguments describing one audio input), that audio
+    is encoded with `audio_codec` and muxed in the same pass.
+    """
+    list_path = output_path + '.segments.txt'
+    with open(list_path, 'w') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        args = ['-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_input_args:
+            args += list(audio_input_args)
+            args += ['-map', '0:v:0', '-map', '1:a:0', '-c:a', audio_codec]
+        args += ['-c:v', 'copy', '-movflags', '+faststart', output_path]
+        run_ffmpeg(args)
+    finally:
+        os.remove(list_path)
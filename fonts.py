@@ -0,0 +1,143 @@
+import json
+import os
+import re
+import sys
+
+from render_cache import DEFAULT_CACHE_DIR, FONT_INDEX_FILE, atomic_write
+
+# Extensions of the font files that are indexed
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+# Styles that make a face the one a bare family name ("Arial") resolves to
+REGULAR_STYLES = ('regular', 'book', 'normal', 'roman', 'plain')
+
+# Bumped whenever the format of the index changes
+INDEX_VERSION = 1
+
+# The index of this process, loaded or built on first use
+_index = None
+
+
+def font_dirs():
+    """
+    Return the system and user font directories of this platform.
+    """
+    home = os.path.expanduser('~')
+    if sys.platform == 'win32':
+        return [os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts'),
+                os.path.join(os.environ.get('LOCALAPPDATA', home), 'Microsoft', 'Windows', 'Fonts')]
+    if sys.platform == 'darwin':
+        return ['/System/Library/Fonts', '/Library/Fonts', os.path.join(home, 'Library', 'Fonts')]
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.join(home, '.local', 'share')
+    return ['/usr/share/fonts', '/usr/local/share/fonts', os.path.join(data_home, 'fonts'), os.path.join(home, '.fonts')]
+
+
+def normalize_name(name):
+    """
+    Return the lookup form of a font name: lower case letters and digits only, so
+    "Times New Roman", "times-new-roman" and "TimesNewRoman" are the same name.
+    """
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+def scan_fonts(dirs):
+    """
+    Read the names of every font file under `dirs`.
+
+    Returns (fonts, signature): fonts maps each normalized name to a file path, and the
+    signature maps each scanned directory to its modification time, which changes when
+    fonts are added to or removed from it. A font is known by its file name, its
+    "family style" name and, for the regular face or else the first face of a family,
+    its family name. Collections (.ttc) are indexed by their first face.
+    """
+    from PIL import ImageFont
+
+    paths, signature = [], {}
+    for root in dirs:
+        for dirpath, dirnames, filenames in os.walk(root):
+            signature[dirpath] = os.stat(dirpath).st_mtime_ns
+            paths += [os.path.join(dirpath, name) for name in filenames if name.lower().endswith(FONT_EXTENSIONS)]
+
+    fonts, families = {}, {}
+    for path in sorted(paths):
+        fonts.setdefault(normalize_name(os.path.splitext(os.path.basename(path))[0]), path)
+        try:
+            family, style = ImageFont.truetype(path, 12).getname()
+        except (OSError, ValueError):
+            continue
+        if not family:
+            continue
+        fonts.setdefault(normalize_name(f"{family} {style or ''}"), path)
+        family = normalize_name(family)
+        regular = (style or 'regular').lower() in REGULAR_STYLES
+        if family not in families or (regular and not families[family]):
+            fonts[family] = path
+            families[family] = regular
+    return fonts, signature
+
+
+def index_path():
+    """
+    Return the path of the persisted font index, kept in the render cache directory.
+    """
+    return os.path.join(os.environ.get('PODCAST_MAKER_CACHE') or DEFAULT_CACHE_DIR, FONT_INDEX_FILE)
+
+
+def _is_current(index, dirs):
+    if index.get('version') != INDEX_VERSION or index.get('roots') != dirs:
+        return False
+    for dirpath, mtime in index['signature'].items():
+        try:
+            if os.stat(dirpath).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    # A font directory created since the scan
+    return all(not os.path.isdir(root) or root in index['signature'] for root in dirs)
+
+
+def font_index(rescan=False):
+    """
+    Return the {normalized name: path} index of the installed fonts.
+
+    The font directories are scanned once and the index is stored in the cache directory;
+    later processes only check the modification times of the scanned directories and
+    rescan when fonts were installed or removed (or with `rescan`).
+    """
+    global _index
+    if _index is not None and not rescan:
+        return _index
+
+    dirs = font_dirs()
+    path = index_path()
+    index = None
+    if not rescan:
+        try:
+            with open(path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+    if index is None or not _is_current(index, dirs):
+        fonts, signature = scan_fonts(dirs)
+        index = {'version': INDEX_VERSION, 'roots': dirs, 'signature': signature, 'fonts': fonts}
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Concurrent workers never read a partial index
+            atomic_write(path, lambda f: f.write(json.dumps(index).encode()))
+        except OSError:
+            pass
+    _index = index['fonts']
+    return _index
+
+
+def resolve_font(name):
+    """
+    Return the font file for a font name (e.g. "Arial", "DejaVu Sans Bold") or path, or None
+    if no installed font has that name.
+    """
+    if not name:
+        return None
+    name = os.path.expanduser(name)
+    if os.path.isfile(name):
+        return name
+    return font_index().get(normalize_name(name))
@@ -0,0 +1,387 @@
+import functools
+import os
+import subprocess
+
+import numpy as np
+
+from ffmpeg_utils import ffmpeg_binary
+
+
+# Number of decoded backgrounds kept in memory, so jobs sharing a background decode it once
+BACKGROUND_CACHE_SIZE = 8
+
+# Bar values closer than this (in dB, about 0.05 px of bar length at full size) count as
+# equal when detecting repeated frames
+DEDUP_RESOLUTION = 0.01
+
+
+def scaled_size(size, scale):
+    """
+    Scale a (width, height) size, rounding down to even dimensions as yuv420p requires.
+    """
+    if scale == 1:
+        return tuple(size)
+    return tuple(max(int(side * scale) // 2 * 2, 2) for side in size)
+
+
+def load_background(image_path, scale=1.0, size=None):
+    """
+    Decode the background image to a read-only RGB uint8 array (transparent parts over
+    black, as in CompositeVideoClip), resized by `scale`.
+
+    With an output `size` (width, height) the image is scaled to cover it and center-cropped
+    to it instead, so later stages never touch pixels of the full-size source.
+
+    Decoded images are kept per process and reused while the file is unchanged.
+    """
+    stat = os.stat(image_path)
+    return _decode_background(os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns, scale,
+                              tuple(size) if size else None)
+
+
+def cover_box(source_size, size):
+    """
+    Return the centered (left, top, right, bottom) box of `source_size` with the aspect ratio of `size`.
+    """
+    width, height = source_size
+    crop_width, crop_height = min(width, height * size[0] / size[1]), min(height, width * size[1] / size[0])
+    left, top = (width - crop_width) / 2, (height - crop_height) / 2
+    return (left, top, left + crop_width, top + crop_height)
+
+
+@functools.lru_cache(maxsize=BACKGROUND_CACHE_SIZE)
+def _decode_background(image_path, file_size, mtime_ns, scale=1.0, size=None):
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        if size:
+            # JPEGs are decoded at a reduced scale when that still covers the output
+            img.draft('RGB', size)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            flat = Image.new('RGB', img.size, (0, 0, 0))
+            flat.paste(img, mask=img.getchannel('A'))
+        else:
+            flat = img.convert('RGB')
+    if size:
+        flat = flat.resize(size, Image.BILINEAR, box=cover_box(flat.size, size), reducing_gap=2.0)
+    elif scale != 1:
+        flat = flat.resize(scaled_size(flat.size, scale), Image.BILINEAR)
+    background = np.array(flat)
+    background.flags.writeable = False
+    return background
+
+
+def clip_box(position, size, frame_size):
+    """
+    Intersect a layer of `size` at `position` with the frame.
+
+    Returns ((x0, y0, x1, y1) in frame coordinates, (lx, ly) offset into the layer), or None.
+    """
+    x, y = position
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + size[0], frame_size[0]), min(y + size[1], frame_size[1])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1, y1), (x0 - x, y0 - y)
+
+
+class FrameCompositor:
+    """
+    Composites background, visualization and heading into a reused output buffer.
+
+    The background and heading never change, so they are flattened once into a base frame.
+    Per frame only the region the visualization can draw into is rewritten: the background
+    is restored there, the visualization is alpha-blended over it and the part of the
+    heading that overlaps the region is blended back on top (the heading is the top layer).
+    """
+
+    def __init__(self, background, heading, heading_position, vis_size, vis_position=(0, 0), vis_bbox=None):
+        height, width = background.shape[:2]
+        self.size = (width, height)
+        heading = np.asarray(heading)
+
+        # Base frame: background with the heading blended over it
+        self.base = background.copy()
+        heading_box = clip_box(heading_position, (heading.shape[1], heading.shape[0]), self.size)
+        if heading_box:
+            (x0, y0, x1, y1), (lx, ly) = heading_box
+            layer = heading[ly:ly + y1 - y0, lx:lx + x1 - x0]
+            self.base[y0:y1, x0:x1] = blend(self.base[y0:y1, x0:x1], layer)
+        self.frame = self.base.copy()
+
+        # Region of the frame the visualization can draw into
+        if vis_bbox is None:
+            vis_bbox = (0, 0, vis_size[0], vis_size[1])
+        bx0, by0, bx1, by1 = vis_bbox
+        self.region = None
+        box = clip_box((vis_position[0] + bx0, vis_position[1] + by0), (bx1 - bx0, by1 - by0), self.size)
+        if box is None:
+            return
+        (x0, y0, x1, y1), (lx, ly) = box
+        self.region = (x0, y0, x1, y1)
+        self.vis_slice = (slice(by0 + ly, by0 + ly + y1 - y0), slice(bx0 + lx, bx0 + lx + x1 - x0))
+        self.under = background[y0:y1, x0:x1].astype(np.float32)
+        # Work buffers of the blend, reused for every frame
+        self._alpha = np.empty((y1 - y0, x1 - x0, 1), dtype=np.float32)
+        self._out = np.empty((y1 - y0, x1 - x0, 3), dtype=np.float32)
+
+        # Part of the heading that lies over the region, premultiplied for the blend
+        self.over = None
+        if heading_box:
+            (hx0, hy0, hx1, hy1), (hlx, hly) = heading_box
+            ox0, oy0, ox1, oy1 = max(x0, hx0), max(y0, hy0), min(x1, hx1), min(y1, hy1)
+            if ox1 > ox0 and oy1 > oy0:
+                layer = heading[hly + oy0 - hy0:hly + oy1 - hy0, hlx + ox0 - hx0:hlx + ox1 - hx0]
+                alpha = layer[..., 3:4].astype(np.float32) / 255
+                if alpha.any():
+                    self.over = (
+                        (slice(oy0 - y0, oy1 - y0), slice(ox0 - x0, ox1 - x0)),
+                        layer[..., :3].astype(np.float32) * alpha,
+                        1 - alpha,
+                    )
+
+    def compose(self, vis):
+        """
+        Blend one RGBA visualization frame and return the (reused) RGB output frame.
+        """
+        if self.region is None:
+            return self.frame
+        x0, y0, x1, y1 = self.region
+        layer = vis[self.vis_slice]
+        alpha = np.multiply(layer[..., 3:4], np.float32(1 / 255), out=self._alpha)
+        out = np.subtract(layer[..., :3], self.under, out=self._out)
+        out *= alpha
+        out += self.under
+        if self.over is not None:
+            index, premultiplied, transparency = self.over
+            part = out[index]
+            part *= transparency
+            part += premultiplied
+        out += np.float32(0.5)
+        np.copyto(self.frame[y0:y1, x0:x1], out, casting='unsafe')
+        return self.frame
+
+
+class OverlayCompositor:
+    """
+    Stands in for FrameCompositor when ffmpeg does the compositing (see create_overlay_writer).
+
+    A frame is only the alpha channel of the visualization's bbox, one byte per pixel;
+    ffmpeg gives it the wave color and overlays it on the background and heading.
+    """
+
+    def __init__(self, vis_bbox):
+        x0, y0, x1, y1 = vis_bbox
+        self.size = (x1 - x0, y1 - y0)
+        self.position = (x0, y0)
+        self.frame = np.empty((y1 - y0, x1 - x0), dtype=np.uint8)
+        self.alpha = (slice(y0, y1), slice(x0, x1), 3)
+
+    def compose(self, vis):
+        self.frame[...] = vis[self.alpha]
+        return self.frame
+
+
+def create_overlay_writer(outputs, vis_bbox, fps, workdir, **options):
+    """
+    Return (compositor, writer) for the overlay engine: Python only pipes the alpha plane of
+    the visualization's `vis_bbox`, and a single ffmpeg filter graph merges it with the wave
+    color and overlays it on the looped background image, with the heading image on top.
+
+    `outputs` are dicts describing one encoded file each: "output_path", "background" (RGB
+    array), "heading" (RGBA array), "heading_position", "color" and "vis_bbox" (where the
+    visualization goes in that output; the piped plane is scaled to its size), plus encoder
+    options as for FFmpegFrameWriter. The piped plane is split between them, so further
+    outputs only cost their compositing and encoding. The images are written as PNG files
+    to `workdir`; `options` (audio input) are passed on to FFmpegFrameWriter.
+    """
+    from PIL import Image
+
+    compositor = OverlayCompositor(vis_bbox)
+    labels = ['out'] + [f'out{index}' for index in range(1, len(outputs))]
+    inputs, graph = [], []
+    if len(outputs) > 1:
+        graph.append('[0:v]split={}{};'.format(len(outputs), ''.join(f'[alpha{index}]' for index in range(len(outputs)))))
+    for index, (output, label) in enumerate(zip(outputs, labels)):
+        background_path = os.path.join(workdir, f'background{index}.png')
+        heading_path = os.path.join(workdir, f'heading{index}.png')
+        background = np.asarray(output['background'])
+        Image.fromarray(background).save(background_path, compress_level=1)
+
+        # Only the visible part of the heading is overlaid on every frame
+        heading = np.asarray(output['heading'])
+        heading_position = output['heading_position']
+        rows, cols = np.nonzero(heading[..., 3])
+        if len(rows):
+            top, left = rows.min(), cols.min()
+            heading = heading[top:rows.max() + 1, left:cols.max() + 1]
+            heading_position = (heading_position[0] + left, heading_position[1] + top)
+        Image.fromarray(heading).save(heading_path, compress_level=1)
+        background_input, heading_input = 1 + len(inputs), 2 + len(inputs)
+        inputs += [['-i', background_path], ['-i', heading_path]]
+
+        x0, y0, x1, y1 = output['vis_bbox']
+        width, height = x1 - x0, y1 - y0
+        alpha = f'[alpha{index}]' if len(outputs) > 1 else '[0:v]'
+        if (width, height) != compositor.size:
+            graph.append(f'{alpha}scale={width}:{height}[alpha{index}s];')
+            alpha = f'[alpha{index}s]'
+        red, green, blue = (int(c) for c in output['color'][:3])
+        # The background is decoded once and looped for as long as the piped frames last (at
+        # the frame rate of the pipe, or the encoder duplicates frames); the heading is a
+        # single frame that the last overlay repeats
+        graph.append(
+            f'[{background_input}:v]loop=loop=-1:size=1,settb=1/{fps},setpts=N,fps={fps}[background{index}];'
+            f'color=c=0x{red:02x}{green:02x}{blue:02x}:s={width}x{height}:r={fps},format=gbrap[color{index}];'
+            f'[color{index}]{alpha}alphamerge=shortest=1[vis{index}];'
+            f'[background{index}][vis{index}]overlay=x={x0}:y={y0}:format=gbrp:shortest=1[base{index}];'
+            f'[base{index}][{heading_input}:v]overlay=x={heading_position[0]}:y={heading_position[1]}:format=gbrp[{label}];'
+        )
+
+    first, *others = [
+        {key: value for key, value in output.items()
+         if key not in ('background', 'heading', 'heading_position', 'color', 'vis_bbox')}
+        for output in outputs
+    ]
+    for output, encoder, label in zip(outputs[1:], others, labels[1:]):
+        background = output['background']
+        encoder.update(video_map=f'[{label}]', output_size=(background.shape[1], background.shape[0]))
+    background = outputs[0]['background']
+    writer = FFmpegFrameWriter(size=compositor.size, fps=fps, pix_fmt='gray', inputs=inputs,
+                               filter_complex=''.join(graph).rstrip(';'), outputs=others,
+                               output_size=(background.shape[1], background.shape[0]), **first, **options)
+    return compositor, writer
+
+
+def blend(under, layer):
+    """
+    Alpha-blend an RGBA uint8 layer over an RGB uint8 array of the same size.
+    """
+    alpha = layer[..., 3:4].astype(np.float32) / 255
+    out = under * (1 - alpha) + layer[..., :3] * alpha
+    return (out + 0.5).astype(np.uint8)
+
+
+def encoder_args(output_path, output_size, video_map, audio_map=None, codec='libx264', preset='faster',
+                 bitrate='5000k', crf=23, threads=None, audio_codec='aac', ffmpeg_params=()):
+    """
+    Return the ffmpeg arguments of one output encoding the `video_map` stream (and the
+    `audio_map` stream, if given) to `output_path`.
+    """
+    args = ['-map', video_map]
+    if audio_map:
+        args += ['-map', audio_map, '-c:a', audio_codec]
+    args += ['-c:v', codec, '-preset', preset, '-crf', str(crf)]
+    if bitrate:
+        args += ['-b:v', bitrate]
+    if threads:
+        args += ['-threads', str(threads)]
+    if codec == 'libx264' and output_size[0] % 2 == 0 and output_size[1] % 2 == 0:
+        args += ['-pix_fmt', 'yuv420p']
+    return args + list(ffmpeg_params) + [output_path]
+
+
+class FFmpegFrameWriter:
+    """
+    Encodes raw frames written straight into the stdin of an ffmpeg subprocess.
+
+    Frames are RGB by default (`pix_fmt`). `inputs` are further ffmpeg inputs (each a list of
+    arguments) and `filter_complex` a filter graph over all inputs, the raw frames being
+    input 0, whose "[out]" output is encoded. If `audio_input_args` (ffmpeg arguments for
+    one audio input) are given, that audio is encoded with `audio_codec` and muxed into the
+    output in the same process.
+
+    `outputs` are further files encoded by the same process, each a dict of encoder_args
+    arguments (with the graph output label as "video_map"); the audio goes into all of them.
+    """
+
+    def __init__(self, output_path, size, fps, codec='libx264', preset='faster', bitrate='5000k', crf=23,
+                 threads=None, audio_input_args=None, audio_codec='aac', ffmpeg_params=(), pix_fmt='rgb24',
+                 inputs=(), filter_complex=None, output_size=None, outputs=()):
+        self.output_path = output_path
+        cmd = [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+               '-f', 'rawvideo', '-vcodec', 'rawvideo', '-pix_fmt', pix_fmt,
+               '-s', f'{size[0]}x{size[1]}', '-r', str(fps), '-i', '-']
+        for input_args in inputs:
+            cmd += list(input_args)
+        audio_map = None
+        if audio_input_args:
+            cmd += list(audio_input_args)
+            audio_map = f'{1 + len(inputs)}:a:0'
+        if filter_complex:
+            cmd += ['-filter_complex', filter_complex]
+        cmd += encoder_args(output_path, output_size or size, '[out]' if filter_complex else '0:v:0', audio_map,
+                            codec, preset, bitrate, crf, threads, audio_codec, ffmpeg_params)
+        for output in outputs:
+            cmd += encoder_args(**dict(output, audio_map=audio_map, audio_codec=audio_codec))
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        try:
+            self.proc.stdin.write(memoryview(np.ascontiguousarray(frame)))
+        except (BrokenPipeError, OSError):
+            self.close()
+            raise
+
+    def close(self):
+        if self.proc is None:
+            return
+        proc, self.proc = self.proc, None
+        try:
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        error = proc.stderr.read()
+        proc.stderr.close()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed writing {self.output_path}: {error.decode(errors='replace').strip()}")
+
+    def abort(self):
+        """
+        Kill the encoder without waiting for it to finish the file.
+        """
+        if self.proc is None:
+            return
+        proc, self.proc = self.proc, None
+        proc.kill()
+        proc.wait()
+        proc.stdin.close()
+        proc.stderr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def render_video(bar_heights, renderer, compositor, writer, start=0, end=None, progress=None, dedup=True):
+    """
+    Render frames [start, end) of the bar-height matrix through the compositor into the writer.
+
+    With `dedup`, a frame whose bar values equal the previous frame's after quantizing to
+    DEDUP_RESOLUTION (silence, steady room tone) is neither rendered nor composited: the
+    previous output buffer is written again. Returns the number of frames reused that way.
+
+    `progress`, if given, is called with 1 after every frame written.
+    """
+    end = len(bar_heights) if end is None else end
+    vis = frame = previous = None
+    reused = 0
+    for index in range(start, end):
+        values = bar_heights[index]
+        key = np.rint(values * np.float32(1 / DEDUP_RESOLUTION)) if dedup else None
+        if frame is not None and dedup and np.array_equal(key, previous):
+            reused += 1
+        else:
+            vis = renderer.render(values, out=vis)
+            frame = compositor.compose(vis)
+        writer.write(frame)
+        previous = key
+        if progress:
+            progress(1)
+    return reused
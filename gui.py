@@ -1,30 +1,36 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
 import sys
 import os
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QTextEdit, QProgressBar, QColorDialog, QListWidget, QDialog
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from video_generator import generate_video
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QTextEdit, QProgressBar, QColorDialog, QListWidget, QListWidgetItem, QDialog, QDoubleSpinBox, QSpinBox, QComboBox
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
+from render_queue import CANCELLED, DONE, FAILED, RUNNING, RenderQueue
+from video_generator import DRAFT_DURATION, RESOLUTIONS, preview_frame
+
+IMPORT_TIME = time.perf_counter() - STARTUP_TIME
+
+# Scale of the preview frame relative to the video, and delay after the last input change before it is refreshed (ms)
+PREVIEW_SCALE = 0.5
+PREVIEW_DELAY = 300
 
-class VideoGeneratorThread(QThread):
-    progress_update = pyqtSignal(int)
-    log_update = pyqtSignal(str)
+# Interval at which the render queue is polled for events (ms)
+QUEUE_POLL_INTERVAL = 100
+
+class PreviewThread(QThread):
+    preview_ready = pyqtSignal(object)
+    preview_failed = pyqtSignal(str)
 
     def __init__(self, params):
         super().__init__()
         self.params = params
 
     def run(self):
-        generate_video(
-            self.params['audio_path'],
-            self.params['image_path'],
-            self.params['heading_text'],
-            self.params['font'],
-            self.params['heading_color'],
-            self.params['outline_color'],
-            self.params['wave_color'],
-            self.params['output_path'],
-            progress_callback=self.progress_update.emit,
-            log_callback=self.log_update.emit
-        )
+        try:
+            self.preview_ready.emit(preview_frame(**self.params, scale=PREVIEW_SCALE))
+        except Exception as e:
+            self.preview_failed.emit(str(e))
 
 class CustomFileBrowser(QDialog):
     def __init__(self, parent=None):
@@ -87,7 +93,16 @@ class CustomFileBrowser(QDialog):
 class VideoGeneratorGUI(QWidget):
     def __init__(self):
         super().__init__()
+        self.preview_thread = None
+        self.preview_pending = False
+        # Renders run in worker processes, so the window stays responsive and jobs can be cancelled
+        self.render_queue = RenderQueue(max_workers=1, on_event=self.handle_render_event)
+        self.job_items = {}
+        self.current_job = None
         self.initUI()
+        self.queue_timer = QTimer(self)
+        self.queue_timer.timeout.connect(self.render_queue.poll)
+        self.queue_timer.start(QUEUE_POLL_INTERVAL)
 
     def initUI(self):
         layout = QVBoxLayout()
@@ -164,15 +179,72 @@ class VideoGeneratorGUI(QWidget):
         output_layout.addWidget(output_button)
         layout.addLayout(output_layout)
 
-        # Generate button
+        # Output resolution: the background image's size or one of the named resolutions
+        resolution_layout = QHBoxLayout()
+        resolution_layout.addWidget(QLabel('Resolution:'))
+        self.resolution_input = QComboBox()
+        self.resolution_input.addItem('Background size', None)
+        for name, (width, height) in RESOLUTIONS.items():
+            self.resolution_input.addItem(f'{name} ({width}x{height})', name)
+        self.resolution_input.currentIndexChanged.connect(lambda index: self.preview_timer.start())
+        resolution_layout.addWidget(self.resolution_input)
+        layout.addLayout(resolution_layout)
+
+        # Preview of the frame at the chosen time, refreshed shortly after any input changes
+        preview_time_layout = QHBoxLayout()
+        preview_time_layout.addWidget(QLabel('Preview Time (s):'))
+        self.preview_time_input = QDoubleSpinBox()
+        self.preview_time_input.setRange(0, 24 * 3600)
+        preview_time_layout.addWidget(self.preview_time_input)
+        layout.addLayout(preview_time_layout)
+
+        self.preview_label = QLabel('Preview')
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_label.setMinimumHeight(200)
+        layout.addWidget(self.preview_label)
+
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY)
+        self.preview_timer.timeout.connect(self.refresh_preview)
+        for field in (self.audio_input, self.image_input, self.heading_input, self.font_input):
+            field.textChanged.connect(self.preview_timer.start)
+        self.preview_time_input.valueChanged.connect(self.preview_timer.start)
+
+        # Generate buttons
+        generate_layout = QHBoxLayout()
+        self.draft_button = QPushButton('Render Draft')
+        self.draft_button.clicked.connect(lambda: self.generate_video(draft=True))
+        generate_layout.addWidget(self.draft_button)
         self.generate_button = QPushButton('Generate Video')
-        self.generate_button.clicked.connect(self.generate_video)
-        layout.addWidget(self.generate_button)
+        self.generate_button.clicked.connect(lambda: self.generate_video())
+        generate_layout.addWidget(self.generate_button)
+        layout.addLayout(generate_layout)
+
+        # Render queue: jobs run one after another, or up to "Parallel Renders" at a time
+        queue_layout = QHBoxLayout()
+        queue_layout.addWidget(QLabel('Parallel Renders:'))
+        self.parallel_input = QSpinBox()
+        self.parallel_input.setRange(1, os.cpu_count() or 1)
+        self.parallel_input.valueChanged.connect(self.set_parallel_renders)
+        queue_layout.addWidget(self.parallel_input)
+        self.cancel_button = QPushButton('Cancel Selected')
+        self.cancel_button.clicked.connect(self.cancel_job)
+        queue_layout.addWidget(self.cancel_button)
+        layout.addLayout(queue_layout)
+
+        self.job_list = QListWidget()
+        self.job_list.setMaximumHeight(100)
+        layout.addWidget(self.job_list)
 
         # Progress bar
         self.progress_bar = QProgressBar()
         layout.addWidget(self.progress_bar)
 
+        # Current stage, or frames rendered, fps and time left
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
         # Log output
         self.log_output = QTextEdit()
         self.log_output.setReadOnly(True)
@@ -200,9 +272,10 @@ class VideoGeneratorGUI(QWidget):
             elif color_type == 'wave':
                 self.wave_color = color_hex
                 self.wave_color_button.setText(color_hex)
+            self.preview_timer.start()
 
-    def generate_video(self):
-        params = {
+    def preview_params(self):
+        return {
             'audio_path': self.audio_input.text(),
             'image_path': self.image_input.text(),
             'heading_text': self.heading_input.text(),
@@ -210,30 +283,120 @@ class VideoGeneratorGUI(QWidget):
             'heading_color': self.heading_color,
             'outline_color': self.outline_color,
             'wave_color': self.wave_color,
-            'output_path': self.output_input.text()
+            't': self.preview_time_input.value(),
+            'resolution': self.resolution_input.currentData()
         }
 
-        self.generate_button.setEnabled(False)
-        self.progress_bar.setValue(0)
-        self.log_output.clear()
-
-        self.thread = VideoGeneratorThread(params)
-        self.thread.progress_update.connect(self.update_progress)
-        self.thread.log_update.connect(self.update_log)
-        self.thread.finished.connect(self.generation_finished)
-        self.thread.start()
-
-    def update_progress(self, value):
-        self.progress_bar.setValue(value)
-
-    def update_log(self, message):
-        self.log_output.append(message)
-
-    def generation_finished(self):
-        self.generate_button.setEnabled(True)
-        self.log_output.append("Video generation completed!")
+    def refresh_preview(self):
+        params = self.preview_params()
+        if not all(params[field] for field in ('audio_path', 'image_path', 'heading_text')):
+            return
+        if not (os.path.isfile(os.path.expanduser(params['audio_path'])) and os.path.isfile(os.path.expanduser(params['image_path']))):
+            return
+        # Only one preview is computed at a time; changes made meanwhile trigger one more refresh
+        if self.preview_thread is not None and self.preview_thread.isRunning():
+            self.preview_pending = True
+            return
+        self.preview_pending = False
+        self.preview_thread = PreviewThread(params)
+        self.preview_thread.preview_ready.connect(self.show_preview)
+        self.preview_thread.preview_failed.connect(self.preview_label.setText)
+        self.preview_thread.finished.connect(self.preview_finished)
+        self.preview_thread.start()
+
+    def show_preview(self, frame):
+        height, width = frame.shape[:2]
+        image = QImage(frame.data, width, height, 3 * width, QImage.Format_RGB888).copy()
+        pixmap = QPixmap.fromImage(image)
+        self.preview_label.setPixmap(pixmap.scaled(self.preview_label.width(), self.preview_label.height(),
+                                                   Qt.KeepAspectRatio, Qt.SmoothTransformation))
+
+    def preview_finished(self):
+        if self.preview_pending:
+            self.refresh_preview()
+
+    def generate_video(self, draft=False):
+        params = {
+            'audio_path': self.audio_input.text(),
+            'image_path': self.image_input.text(),
+            'heading_text': self.heading_input.text(),
+            'font': self.font_input.text(),
+            'heading_color': self.heading_color,
+            'outline_color': self.outline_color,
+            'wave_color': self.wave_color,
+            'output_path': self.output_input.text(),
+            'resolution': self.resolution_input.currentData()
+        }
+        if draft:
+            # Drafts start at the preview time and go next to the output as <name>-draft.mp4
+            start = self.preview_time_input.value()
+            params['draft'] = True
+            params['window'] = (start, start + DRAFT_DURATION)
+            params['output_path'] = os.path.splitext(params['output_path'])[0] + '-draft.mp4'
+
+        job = self.render_queue.submit(params)
+        self.log_output.append(f"Job {job.id} queued: {job.output_path}")
+
+    def set_parallel_renders(self, value):
+        self.render_queue.max_workers = value
+        self.render_queue.poll()
+
+    def cancel_job(self):
+        item = self.job_list.currentItem()
+        jobs = [item.data(Qt.UserRole)] if item else self.render_queue.running()
+        for job in jobs:
+            self.render_queue.cancel(job)
+
+    def handle_render_event(self, job, event):
+        kind = event['event']
+        if kind == 'log':
+            self.log_output.append(f"[{job.id}] {event['message']}")
+        elif kind == 'status':
+            if event['status'] == RUNNING:
+                # The progress bar follows the most recently started job
+                self.current_job = job
+                self.progress_bar.setValue(0)
+                self.status_label.clear()
+            elif event['status'] == DONE:
+                self.log_output.append(f"Job {job.id}: Video generation completed!")
+            elif event['status'] in (FAILED, CANCELLED):
+                self.log_output.append(f"Job {job.id}: {event['status']}")
+        elif job is self.current_job:
+            if kind == 'stage_start':
+                self.status_label.setText(f"{event['stage'].replace('_', ' ').capitalize()}...")
+            elif kind == 'progress':
+                self.progress_bar.setValue(int(event['percent']))
+                eta = f", {event['eta']:.0f}s left" if event['eta'] is not None else ""
+                self.status_label.setText(f"{event['frames']}/{event['total_frames']} frames, {event['fps']:.1f} fps{eta}")
+            elif kind == 'done':
+                self.status_label.setText(f"Done in {event['duration']:.1f}s")
+        self.update_job_item(job)
+
+    def update_job_item(self, job):
+        item = self.job_items.get(job.id)
+        if item is None:
+            item = self.job_items[job.id] = QListWidgetItem()
+            item.setData(Qt.UserRole, job)
+            self.job_list.addItem(item)
+        state = f"{job.status} {job.percent:.0f}%" if job.status == RUNNING else job.status
+        item.setText(f"{job.id}. [{state}] {os.path.basename(job.output_path)}")
+
+    def closeEvent(self, event):
+        self.queue_timer.stop()
+        self.render_queue.shutdown()
+        super().closeEvent(event)
+
+def report_startup_time():
+    print(f"gui.py: imports took {IMPORT_TIME * 1000:.0f} ms, "
+          f"window shown after {(time.perf_counter() - STARTUP_TIME) * 1000:.0f} ms")
 
 if __name__ == '__main__':
+    startup_timing = "--startup-timing" in sys.argv
+    if startup_timing:
+        sys.argv.remove("--startup-timing")
     app = QApplication(sys.argv)
     ex = VideoGeneratorGUI()
+    if startup_timing:
+        # Runs once the event loop has started, i.e. after the window is shown
+        QTimer.singleShot(0, report_startup_time)
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimum interval in seconds between two progress events of the frame loop
+PROGRESS_INTERVAL = 0.5
+
+# Minimum interval in seconds between two progress lines printed on the command line
+CONSOLE_PROGRESS_INTERVAL = 5.0
+
+
+class RenderMonitor:
+    """
+    Emits structured events about a render to a list of sinks.
+
+    A sink is any callable taking an event dict. Every event has an "event" type, the
+    seconds "elapsed" since the monitor was created and a wall-clock "timestamp":
+
+    - stage_start / stage_end: "stage" name, and "duration" on stage_end
+    - progress: "frames", "total_frames", "fps", "eta" (seconds), "percent" and
+      "bytes_written" (size of the output file so far, when it is written directly)
+    - log: "message"
+    - done / error: the output, total time, stage durations and counters, or the error message
+    """
+
+    def __init__(self, sinks=(), output_path=None):
+        self.sinks = list(sinks)
+        self.output_path = output_path
+        self.start_time = time.perf_counter()
+        self.stage_durations = {}
+        self.counters = {}
+        self.total_frames = None
+        self._frames = 0
+        self._frames_start = None
+        self._last_progress = 0.0
+        self._lock = threading.Lock()
+
+    def subscribe(self, sink):
+        self.sinks.append(sink)
+
+    def emit(self, event, **fields):
+        fields = dict(event=event, elapsed=round(time.perf_counter() - self.start_time, 3),
+                      timestamp=round(time.time(), 3), **fields)
+        for sink in self.sinks:
+            sink(fields)
+
+    def log(self, message):
+        self.emit('log', message=message)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the render, emitting stage_start and stage_end events around it.
+        """
+        self.emit('stage_start', stage=name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.stage_durations[name] = self.stage_durations.get(name, 0.0) + duration
+            self.emit('stage_end', stage=name, duration=round(duration, 3))
+
+    def start_frames(self, total_frames):
+        """
+        Start the frame loop; progress is measured in rendered frames from here on.
+        """
+        self.total_frames = total_frames
+        self._frames = 0
+        self._frames_start = time.perf_counter()
+        self._last_progress = 0.0
+        self._emit_frames(0, self._frames_start)
+
+    def add_frames(self, count=1):
+        """
+        Record `count` more rendered frames.
+        """
+        with self._lock:
+            self._update(self._frames + count)
+
+    def set_frames(self, frames):
+        """
+        Record that `frames` frames have been rendered in total.
+        """
+        with self._lock:
+            self._update(frames)
+
+    def _update(self, frames):
+        self._frames = frames
+        now = time.perf_counter()
+        # Progress events are throttled to one per PROGRESS_INTERVAL, plus the last frame
+        if frames < self.total_frames and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        self._emit_frames(frames, now)
+
+    def _emit_frames(self, frames, now):
+        elapsed = now - self._frames_start
+        fps = frames / elapsed if elapsed > 0 else 0.0
+        eta = round((self.total_frames - frames) / fps, 1) if fps > 0 else None
+        bytes_written = None
+        if self.output_path and os.path.exists(self.output_path):
+            bytes_written = os.path.getsize(self.output_path)
+        self.emit('progress', frames=frames, total_frames=self.total_frames, fps=round(fps, 2), eta=eta,
+                  percent=round(100 * frames / max(self.total_frames, 1), 1), bytes_written=bytes_written)
+
+    def count(self, name, value):
+        """
+        Add `value` to a named counter, reported with the done event (e.g. frames_reused).
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self):
+        bytes_written = os.path.getsize(self.output_path) if self.output_path and os.path.exists(self.output_path) else None
+        self.emit('done', output_path=self.output_path, bytes_written=bytes_written,
+                  duration=round(time.perf_counter() - self.start_time, 3),
+                  stages={name: round(duration, 3) for name, duration in self.stage_durations.items()},
+                  counters=dict(self.counters))
+
+    def fail(self, error):
+        self.emit('error', message=str(error))
+
+
+def callback_sink(progress_callback=None, log_callback=None):
+    """
+    Sink feeding the progress_callback(int percent) / log_callback(str) interface of the GUI.
+    """
+    last = [None]
+
+    def sink(event):
+        if event['event'] == 'log' and log_callback:
+            log_callback(event['message'])
+        elif event['event'] == 'progress' and progress_callback:
+            percent = int(event['percent'])
+            if percent != last[0]:
+                last[0] = percent
+                progress_callback(percent)
+    return sink
+
+
+class ConsoleSink:
+    """
+    Sink for the command line: prints log messages, stage timings and frame progress
+    (at most once every `interval` seconds).
+    """
+
+    def __init__(self, interval=CONSOLE_PROGRESS_INTERVAL):
+        self.interval = interval
+        self.last_print = None
+
+    def __call__(self, event):
+        kind = event['event']
+        if kind == 'log':
+            print(event['message'])
+        elif kind == 'stage_end':
+            print(f"{event['stage']} took {event['duration']:.2f}s")
+        elif kind == 'progress' and event['frames']:
+            final = event['frames'] == event['total_frames']
+            if not final and self.last_print is not None and event['elapsed'] - self.last_print < self.interval:
+                return
+            self.last_print = event['elapsed']
+            eta = f", ETA {event['eta']:.0f}s" if event['eta'] is not None and not final else ""
+            print(f"Rendered {event['frames']}/{event['total_frames']} frames ({event['percent']:.0f}%), "
+                  f"{event['fps']:.1f} fps{eta}", flush=True)
+        elif kind == 'done':
+            size = f", {event['bytes_written'] / 1024 ** 2:.1f} MB" if event['bytes_written'] else ""
+            print(f"Finished in {event['duration']:.2f}s{size}")
+
+
+class JsonLinesSink:
+    """
+    Sink appending every event as one JSON object per line to a file.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'a', buffering=1)
+
+    def __call__(self, event):
+        self.file.write(json.dumps(event) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+def make_progress_bar_logger(monitor):
+    """
+    Return a proglog logger for moviepy's write_videofile that reports its frame loop to the monitor.
+    """
+    import proglog
+
+    class MonitorLogger(proglog.ProgressBarLogger):
+        def bars_callback(self, bar, attr, value, old_value=None):
+            if bar == 't' and attr == 'index':
+                monitor.set_frames(value + 1)
+
+    return MonitorLogger()
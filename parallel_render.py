@@ -0,0 +1,358 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import tempfile
+
+import numpy as np
+
+from ffmpeg_utils import concat_segments
+from render_cache import atomic_write, make_key
+
+# Segment boundaries are multiples of this many frames. Every segment is a separate encode
+# starting on a keyframe, so the joined stream needs no fixed GOP inside the segments.
+KEYFRAME_INTERVAL = 48
+
+# Approximate length in seconds of the chunks of a resumable render (rounded to keyframes)
+CHUNK_DURATION = 60
+
+# File in the chunk directory recording the render parameters and the finished chunks
+CHUNK_MANIFEST = 'manifest.json'
+
+# Files a resumable render writes in the chunk directory; nothing else there is touched
+CHUNK_FILE = re.compile(r'chunk_\d{5}(\.part)?\.mp4$')
+CHUNK_INPUTS = ('bar_heights.npy', 'heading.png')
+
+
+def plan_segments(n_frames, n_segments, keyframe_interval=KEYFRAME_INTERVAL):
+    """
+    Split frames [0, n_frames) into at most `n_segments` contiguous (start, end) ranges
+    whose boundaries fall on keyframes.
+    """
+    n_gops = -(-n_frames // keyframe_interval)
+    n_segments = max(min(n_segments, n_gops), 1)
+    bounds = [round(i * n_gops / n_segments) * keyframe_interval for i in range(n_segments)]
+    bounds.append(n_frames)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def render_segment(job):
+    """
+    Worker: render frames [start, end) of the video to a segment file without audio.
+    Returns the number of repeated frames that were not rendered again.
+
+    The layers are rebuilt in the worker from the shared bar-height matrix (memory-mapped
+    from disk), the background image and the pre-rendered heading image.
+    """
+    from PIL import Image
+
+    # Imported here, video_generator imports this module
+    import video_generator as vg
+    from frame_pipe import load_background, render_video, scaled_size
+
+    fps = job['fps']
+    bar_heights = np.load(job['bar_heights_path'], mmap_mode='r')
+    # Same layout as create_layers for the output resolution
+    scale = vg.layout_scale(job['resolution'])
+    background = load_background(job['image_path'], size=job['resolution'])
+    vis_size = scaled_size(vg.DEFAULT_SIZE, scale)
+    heading_y = int(round(vg.HEADING_Y * scale))
+    with Image.open(job['heading_path']) as heading_image:
+        heading_image.load()
+
+    if job['engine'] in ('pipe', 'overlay'):
+        renderer = vg.make_bar_renderer(job['wave_color'], bar_heights.shape[1], vis_size, backend=job['backend'])
+        compositor = vg.create_frame_compositor(background, heading_image, renderer, heading_y)
+        # Own directory for the overlay engine's images, segments render side by side
+        workdir = tempfile.mkdtemp(dir=os.path.dirname(job['path']))
+        try:
+            compositor, writer = vg.create_frame_writer(
+                job['engine'], job['path'], background, heading_image, renderer, compositor, fps, workdir, heading_y,
+                codec=job['codec'], preset=job['preset'], bitrate=job['bitrate'], crf=job['crf'],
+                threads=job['threads'])
+            with writer:
+                return render_video(bar_heights, renderer, compositor, writer, job['start'], job['end'])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    from moviepy.editor import ImageClip
+    from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+    duration = job['duration']
+    audio_vis = vg.create_visualization_clip(bar_heights, duration, job['wave_color'], fps, job['backend'], vis_size)
+    video = vg.compose_video(ImageClip(background).set_duration(duration), audio_vis,
+                             ImageClip(np.array(heading_image)).set_duration(duration), heading_y)
+    writer = FFMPEG_VideoWriter(job['path'], video.size, fps, codec=job['codec'], preset=job['preset'],
+                                bitrate=job['bitrate'], threads=job['threads'],
+                                ffmpeg_params=['-crf', str(job['crf'])])
+    try:
+        for index in range(job['start'], job['end']):
+            writer.write_frame(video.get_frame(index / fps))
+    finally:
+        writer.close()
+    return 0
+
+
+def segment_jobs(plan, paths, bar_heights_path, heading_path, image_path, wave_color, duration, fps, workers,
+                 resolution=None, engine="pipe", backend="numpy", codec='libx264', preset='faster', bitrate='5000k',
+                 crf=23):
+    """
+    Return the render_segment jobs rendering the (start, end) frame ranges of `plan` to `paths`.
+    """
+    # ffmpeg threads are shared out between the workers
+    threads = max((os.cpu_count() or 1) // workers, 1)
+    return [
+        dict(path=path, start=start, end=end, fps=fps, duration=duration, bar_heights_path=bar_heights_path,
+             image_path=image_path, heading_path=heading_path, wave_color=wave_color, resolution=resolution,
+             engine=engine, backend=backend, codec=codec, preset=preset, bitrate=bitrate, crf=crf, threads=threads)
+        for (start, end), path in zip(plan, paths)
+    ]
+
+
+# Whether this worker process is inside run_segment
+_in_segment = False
+
+
+def _stop_worker(signum, frame):
+    # A second SIGTERM must not interrupt the cleanup of the first
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if not _in_segment:
+        os._exit(1)
+    raise SystemExit(1)
+
+
+def init_segment_worker():
+    """
+    Pool initializer: a terminated worker raises SystemExit in the segment it renders, so
+    its encoder is killed and its temporary files are removed before it exits (see run_segment).
+    """
+    signal.signal(signal.SIGTERM, _stop_worker)
+
+
+def run_segment(job):
+    """
+    Worker: render_segment, returning the job with its number of reused frames. Exits the
+    process once it was terminated and has cleaned up, instead of going on with the next job
+    queued for it.
+    """
+    global _in_segment
+    _in_segment = True
+    try:
+        return job, render_segment(job)
+    except SystemExit:
+        os._exit(1)
+    finally:
+        _in_segment = False
+
+
+def run_segment_jobs(jobs, workers, progress=None, finished=None):
+    """
+    Run render_segment jobs on a pool of `workers` processes. As each job completes,
+    `progress` is called with its number of frames and `finished` with the job and its
+    number of reused frames. Returns the total number of reused frames.
+
+    If a job fails or the caller is interrupted (an exception from a callback, e.g. a
+    cancel, or Ctrl-C), the jobs that did complete are still passed to `finished`, the
+    others are dropped and the workers terminated before the exception propagates.
+    """
+    reused = 0
+    pool = multiprocessing.Pool(workers, initializer=init_segment_worker)
+    results = None
+    try:
+        results = pool.imap_unordered(run_segment, jobs)
+        for job, job_reused in results:
+            reused += job_reused
+            if finished:
+                finished(job, job_reused)
+            if progress:
+                progress(job['end'] - job['start'])
+    except BaseException:
+        if finished and results is not None:
+            # Jobs that completed while the failure was raised
+            while True:
+                try:
+                    finished(*results.next(timeout=0))
+                except (multiprocessing.TimeoutError, StopIteration):
+                    break
+                except Exception:
+                    pass
+        # Workers are stopped instead of finishing their queued jobs; terminate waits only
+        # for them to clean up
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return reused
+
+
+def render_parallel(bar_heights, image_path, heading_image, wave_color, duration, output_path, audio,
+                    fps, segments, workers=None, engine="pipe", backend="numpy", codec='libx264', preset='faster',
+                    bitrate='5000k', crf=23, audio_codec='aac', log=print, progress=None, resolution=None):
+    """
+    Render the video in `segments` keyframe-aligned pieces on a pool of `workers` processes,
+    join them with the concat demuxer (no re-encode) and mux the audio once at the end.
+
+    `heading_image` is the pre-rendered heading (a PIL image) and `audio` the DecodedAudio
+    buffer whose PCM is muxed into the output. `progress`, if given, is called with the
+    number of frames of every segment as it completes. `resolution` is the output size, as
+    in generate_video. Returns the number of repeated frames that were not rendered again.
+    """
+    workers = workers or min(segments, os.cpu_count() or 1)
+    plan = plan_segments(len(bar_heights), segments)
+    workdir = tempfile.mkdtemp(prefix='podcast-maker-segments-')
+    try:
+        # Shared inputs of the workers
+        bar_heights_path = os.path.join(workdir, 'bar_heights.npy')
+        np.save(bar_heights_path, np.asarray(bar_heights, dtype=np.float32))
+        heading_path = os.path.join(workdir, 'heading.png')
+        heading_image.save(heading_path)
+
+        segment_paths = [os.path.join(workdir, f'segment_{i:04d}.mp4') for i in range(len(plan))]
+        jobs = segment_jobs(plan, segment_paths, bar_heights_path, heading_path, image_path, wave_color, duration,
+                            fps, workers, resolution, engine, backend, codec, preset, bitrate, crf)
+        log(f"Rendering {len(jobs)} segments on {workers} worker processes...")
+        reused = run_segment_jobs(jobs, workers, progress)
+
+        log("Joining segments and muxing audio...")
+        concat_segments(segment_paths, output_path, audio.ffmpeg_input_args(), audio_codec)
+        return reused
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def chunk_frames(fps, chunk_duration=CHUNK_DURATION):
+    """
+    Return the number of frames of a chunk: about `chunk_duration` seconds, a multiple of KEYFRAME_INTERVAL.
+    """
+    return max(int(round(chunk_duration * fps / KEYFRAME_INTERVAL)), 1) * KEYFRAME_INTERVAL
+
+
+def load_chunk_manifest(chunk_dir):
+    """
+    Return the manifest of a chunk directory, or None if there is none (or it is unreadable).
+    """
+    try:
+        with open(os.path.join(chunk_dir, CHUNK_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_chunk_manifest(chunk_dir, manifest):
+    # A crash never leaves a truncated manifest
+    atomic_write(os.path.join(chunk_dir, CHUNK_MANIFEST), lambda f: f.write(json.dumps(manifest, indent=2).encode()),
+                 prefix=CHUNK_MANIFEST + '.tmp-')
+
+
+def is_manifest_file(name):
+    return name == CHUNK_MANIFEST or name.startswith(CHUNK_MANIFEST + '.tmp-')
+
+
+def is_chunk_file(name):
+    return bool(CHUNK_FILE.match(name)) or name in CHUNK_INPUTS or is_manifest_file(name)
+
+
+def remove_chunks(chunk_dir, manifest=False):
+    """
+    Delete the chunk files and shared inputs in `chunk_dir`; with `manifest` also the
+    manifest, and then the directory itself if nothing else is left in it.
+    """
+    for name in os.listdir(chunk_dir):
+        if is_chunk_file(name) and (manifest or not is_manifest_file(name)):
+            os.remove(os.path.join(chunk_dir, name))
+    if manifest:
+        try:
+            os.rmdir(chunk_dir)
+        except OSError:
+            pass
+
+
+def render_resumable(bar_heights, image_path, heading_image, wave_color, duration, output_path, audio,
+                     fps, chunk_dir, workers=1, engine="pipe", backend="numpy", codec='libx264', preset='faster',
+                     bitrate='5000k', crf=23, audio_codec='aac', log=print, progress=None, resolution=None,
+                     chunk_duration=CHUNK_DURATION):
+    """
+    Render the video in chunks of about `chunk_duration` seconds kept in `chunk_dir`, then
+    join them without re-encoding and mux the audio. Arguments are as in render_parallel.
+
+    The manifest in `chunk_dir` records the render parameters (including digests of the
+    bar-height matrix and the heading) and every chunk as soon as it is finished. Running
+    the same render again after a crash or cancel only renders the missing chunks; with
+    other parameters the old chunks are discarded. Only files the render writes are ever
+    deleted: a non-empty `chunk_dir` without a manifest raises ValueError, and once the output
+    is written the chunk files are removed, then the directory if that leaves it empty.
+    Returns the number of repeated frames that were not rendered again.
+    """
+    bar_heights = np.asarray(bar_heights, dtype=np.float32)
+    image_stat = os.stat(image_path)
+    frames_per_chunk = chunk_frames(fps, chunk_duration)
+    params = dict(
+        frames=len(bar_heights), chunk_frames=frames_per_chunk, fps=fps, keyframe_interval=KEYFRAME_INTERVAL,
+        bar_heights=hashlib.sha256(bar_heights.tobytes()).hexdigest(),
+        heading=hashlib.sha256(heading_image.tobytes()).hexdigest(), heading_size=list(heading_image.size),
+        image=[os.path.abspath(image_path), image_stat.st_size, image_stat.st_mtime_ns],
+        wave_color=wave_color, resolution=list(resolution) if resolution else None, engine=engine,
+        backend=backend, codec=codec, preset=preset, bitrate=bitrate, crf=crf,
+    )
+    key = make_key('chunks', **params)
+
+    os.makedirs(chunk_dir, exist_ok=True)
+    manifest = load_chunk_manifest(chunk_dir)
+    if manifest is not None and manifest.get('key') != key:
+        log("The chunks in the chunk directory were rendered with other parameters, starting over")
+        manifest = None
+    elif manifest is None and not all(is_chunk_file(name) for name in os.listdir(chunk_dir)):
+        raise ValueError(f"{chunk_dir} is not empty and is not the chunk directory of a render")
+    if manifest is None:
+        remove_chunks(chunk_dir)
+        manifest = {'key': key, 'params': params, 'chunks': {}}
+        save_chunk_manifest(chunk_dir, manifest)
+
+    plan = [(start, min(start + frames_per_chunk, len(bar_heights)))
+            for start in range(0, len(bar_heights), frames_per_chunk)]
+    chunk_paths = [os.path.join(chunk_dir, f'chunk_{i:05d}.mp4') for i in range(len(plan))]
+
+    # A chunk counts as finished if the manifest lists it and its file is complete
+    reused = 0
+    missing = []
+    for index, path in enumerate(chunk_paths):
+        entry = manifest['chunks'].get(os.path.basename(path))
+        if entry and os.path.exists(path) and os.path.getsize(path) == entry['size']:
+            reused += entry['reused']
+            if progress:
+                progress(plan[index][1] - plan[index][0])
+        else:
+            missing.append(index)
+    if len(missing) < len(plan):
+        log(f"Resuming: {len(plan) - len(missing)} of {len(plan)} chunks already rendered")
+
+    if missing:
+        # Shared inputs of the workers, rewritten on every run
+        bar_heights_path = os.path.join(chunk_dir, 'bar_heights.npy')
+        np.save(bar_heights_path, bar_heights)
+        heading_path = os.path.join(chunk_dir, 'heading.png')
+        heading_image.save(heading_path)
+
+        # Chunks are written under a temporary name and renamed once complete
+        jobs = segment_jobs([plan[i] for i in missing], [chunk_paths[i][:-4] + '.part.mp4' for i in missing],
+                            bar_heights_path, heading_path, image_path, wave_color, duration, fps, workers,
+                            resolution, engine, backend, codec, preset, bitrate, crf)
+
+        def finished(job, job_reused):
+            path = job['path'].replace('.part.mp4', '.mp4')
+            os.replace(job['path'], path)
+            manifest['chunks'][os.path.basename(path)] = {
+                'start': job['start'], 'end': job['end'], 'size': os.path.getsize(path), 'reused': job_reused,
+            }
+            save_chunk_manifest(chunk_dir, manifest)
+
+        log(f"Rendering {len(jobs)} chunks of {frames_per_chunk / fps:.0f}s on {workers} worker processes...")
+        reused += run_segment_jobs(jobs, workers, progress, finished)
+
+    log("Joining chunks and muxing audio...")
+    concat_segments(chunk_paths, output_path, audio.ffmpeg_input_args(), audio_codec)
+    remove_chunks(chunk_dir, manifest=True)
+    return reused
@@ -0,0 +1,228 @@
+import collections
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# Default location of the cache, overridable with the PODCAST_MAKER_CACHE environment variable
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'podcast-maker')
+
+# Size cap of the cache; least recently used entries are evicted beyond it
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Bumped whenever the format of the cached data changes
+CACHE_VERSION = 1
+
+# Index of file digests by (path, size, mtime), so unchanged files are not hashed again
+DIGESTS_FILE = 'digests.json'
+
+# Index of the installed fonts by name (see fonts.font_index)
+FONT_INDEX_FILE = 'fonts.json'
+
+# Number of loaded entries kept in memory per process, so long-running processes (batch
+# and server workers) answer repeated lookups without reading the disk again
+MEMORY_ENTRIES = 32
+
+_memory = collections.OrderedDict()
+_memory_digests = {}
+
+
+def make_key(kind, **params):
+    """
+    Return a cache key for an entry of `kind` described by the given (JSON serializable) parameters.
+    """
+    payload = json.dumps(dict(params, version=CACHE_VERSION), sort_keys=True)
+    return f"{kind}-{hashlib.sha256(payload.encode()).hexdigest()[:32]}"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Return the SHA-256 of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_write(path, write, prefix='.tmp-'):
+    """
+    Write a file through `write(f)` on a binary file object. The data goes to a temporary
+    file next to `path` that is renamed over it once complete, so readers (and a crash)
+    never see a partial file; on failure the temporary file is removed.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=prefix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class RenderCache:
+    """
+    Content-addressed on-disk cache for audio features and static layers.
+
+    An entry is a group of files sharing a key (e.g. key.npy and key.json). Arrays are
+    stored as .npy and memory-mapped on reload. Reading an entry refreshes its
+    modification time, which drives the LRU eviction once the cache exceeds `max_bytes`.
+    Loaded entries and file digests are also kept in memory for the life of the process;
+    entries never change once written, so they cannot go stale.
+    """
+
+    def __init__(self, root=None, max_bytes=CACHE_MAX_BYTES):
+        self.root = root or os.environ.get('PODCAST_MAKER_CACHE') or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key, ext):
+        return os.path.join(self.root, key + ext)
+
+    def _touch(self, *paths):
+        for path in paths:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def _recall(self, key, ext):
+        value = _memory.get((self.root, key, ext))
+        if value is not None:
+            _memory.move_to_end((self.root, key, ext))
+        return value
+
+    def _remember(self, key, ext, value):
+        _memory[(self.root, key, ext)] = value
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+        return value
+
+    def _write(self, path, write):
+        # Readers never see partial entries
+        atomic_write(path, write)
+
+    def digest(self, path, compute=True):
+        """
+        Return the content digest of a file, reusing the digest recorded for the same path,
+        size and modification time. With `compute` False, returns None instead of hashing
+        a file that has no recorded digest.
+        """
+        stat = os.stat(path)
+        entry = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        if entry in _memory_digests:
+            return _memory_digests[entry]
+        index_path = os.path.join(self.root, DIGESTS_FILE)
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        if entry not in index:
+            if not compute:
+                return None
+            index[entry] = file_digest(path)
+            self._write(index_path, lambda f: f.write(json.dumps(index).encode()))
+        _memory_digests[entry] = index[entry]
+        return index[entry]
+
+    def load_array(self, key):
+        """
+        Return the cached array for `key` as a read-only memmap, or None.
+        """
+        path = self._path(key, '.npy')
+        array = self._recall(key, '.npy')
+        if array is None:
+            try:
+                array = self._remember(key, '.npy', np.load(path, mmap_mode='r'))
+            except (OSError, ValueError):
+                return None
+        self._touch(path, self._path(key, '.json'))
+        return array
+
+    def store_array(self, key, array, meta=None):
+        self._write(self._path(key, '.npy'), lambda f: np.save(f, np.asarray(array)))
+        if meta is not None:
+            self.store_meta(key, meta)
+        self.evict()
+
+    def load_meta(self, key):
+        path = self._path(key, '.json')
+        meta = self._recall(key, '.json')
+        if meta is None:
+            try:
+                with open(path) as f:
+                    meta = self._remember(key, '.json', json.load(f))
+            except (OSError, ValueError):
+                return None
+        self._touch(path)
+        return dict(meta)
+
+    def store_meta(self, key, meta):
+        self._write(self._path(key, '.json'), lambda f: f.write(json.dumps(meta).encode()))
+
+    def load_image(self, key):
+        """
+        Return the cached image for `key` as a PIL image, or None.
+        """
+        from PIL import Image
+
+        path = self._path(key, '.png')
+        img = self._recall(key, '.png')
+        if img is None:
+            try:
+                with Image.open(path) as img:
+                    img.load()
+            except (OSError, ValueError):
+                return None
+            self._remember(key, '.png', img)
+        self._touch(path)
+        return img.copy()
+
+    def store_image(self, key, image):
+        self._write(self._path(key, '.png'), lambda f: image.save(f, format='PNG'))
+        self.evict()
+
+    def entries(self):
+        """
+        Return {key: (size in bytes, last use time, file names)} for all entries in the cache.
+        """
+        entries = {}
+        for name in os.listdir(self.root):
+            if name.startswith('.') or name in (DIGESTS_FILE, FONT_INDEX_FILE):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root, name))
+            except OSError:
+                continue
+            key = os.path.splitext(name)[0]
+            size, used, names = entries.get(key, (0, 0, []))
+            entries[key] = (size + stat.st_size, max(used, stat.st_mtime), names + [name])
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+        """
+        entries = self.entries()
+        total = sum(size for size, _, _ in entries.values())
+        for size, _, names in sorted(entries.values(), key=lambda entry: entry[1]):
+            if total <= self.max_bytes:
+                break
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self):
+        for entry in [entry for entry in _memory if entry[0] == self.root]:
+            del _memory[entry]
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
@@ -0,0 +1,219 @@
+import itertools
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import wait
+
+# Seconds a cancelled job gets to stop its encoder and clean up before its processes are killed
+CANCEL_TIMEOUT = 5.0
+
+# States of a render job
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+def run_render_job(params, conn):
+    """
+    Worker process: run generate_video with `params`, sending its events through `conn`,
+    followed by a final {"event": "finished", "status": ...} event.
+
+    SIGTERM cancels the render: generate_video unwinds, which kills its ffmpeg process and
+    removes its temporary files.
+    """
+    # Own process group, so the queue can also kill ffmpeg and segment workers if needed
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    cancelled = []
+
+    def cancel(signum, frame):
+        cancelled.append(signum)
+        raise RenderCancelled("Render cancelled")
+
+    signal.signal(signal.SIGTERM, cancel)
+    try:
+        import video_generator
+
+        ok = video_generator.generate_video(**params, event_callback=conn.send)
+        status = DONE if ok else CANCELLED if cancelled else FAILED
+    except RenderCancelled:
+        status = CANCELLED
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        conn.send({'event': 'finished', 'status': status})
+    except (BrokenPipeError, OSError):
+        pass
+    finally:
+        conn.close()
+
+
+class RenderJob:
+    """
+    A render queued on a RenderQueue: its generate_video parameters, state and last progress.
+    """
+
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.status = QUEUED
+        self.percent = 0
+        self.error = None
+        self.final_status = None
+        self.process = None
+        self.conn = None
+        self.cancel_time = None
+        # Outputs before the render started (see video_generator.snapshot_outputs)
+        self.outputs = None
+
+    @property
+    def output_path(self):
+        return self.params['output_path']
+
+
+class RenderQueue:
+    """
+    Runs renders in worker processes, at most `max_workers` at a time, in submission order.
+
+    Rendering outside the caller's process keeps a GUI responsive. Call poll() regularly
+    (e.g. from a timer): it forwards the events of running jobs to `on_event(job, event)`,
+    starts queued jobs as slots free up and kills cancelled jobs that do not stop in time.
+    State changes are reported as {"event": "status", "status": ...} events.
+    """
+
+    def __init__(self, max_workers=1, on_event=None):
+        self.max_workers = max_workers
+        self.on_event = on_event
+        self.jobs = []
+        self._ids = itertools.count(1)
+        # Spawned workers do not inherit the caller's threads or GUI state
+        self._context = multiprocessing.get_context('spawn')
+
+    def submit(self, params):
+        """
+        Queue a render with the given generate_video keyword arguments and return its RenderJob.
+        """
+        job = RenderJob(next(self._ids), dict(params))
+        self.jobs.append(job)
+        self._notify(job, {'event': 'status', 'status': QUEUED})
+        self._start_queued()
+        return job
+
+    def running(self):
+        return [job for job in self.jobs if job.status == RUNNING]
+
+    def pending(self):
+        return [job for job in self.jobs if job.status in (QUEUED, RUNNING)]
+
+    def cancel(self, job):
+        """
+        Cancel a queued or running job. A running job is asked to stop, and killed with its
+        ffmpeg process if it has not stopped after CANCEL_TIMEOUT; the outputs it wrote are
+        removed, files that were already there and never opened by the render are kept.
+        """
+        if job.status == QUEUED:
+            self._finish(job, CANCELLED)
+        elif job.status == RUNNING and job.cancel_time is None:
+            job.cancel_time = time.monotonic()
+            job.process.terminate()
+
+    def poll(self, timeout=0):
+        """
+        Dispatch pending events of running jobs and start or reap jobs as needed.
+        """
+        running = {job.conn: job for job in self.running()}
+        for conn in wait(list(running), timeout) if running else []:
+            job = running[conn]
+            try:
+                while conn.poll():
+                    self._handle(job, conn.recv())
+            except (EOFError, OSError):
+                pass
+        for job in self.running():
+            if not job.process.is_alive():
+                self._drain(job)
+                status = job.final_status or FAILED
+                if job.cancel_time is not None and status != DONE:
+                    status = CANCELLED
+                self._finish(job, status)
+            elif job.cancel_time is not None and time.monotonic() - job.cancel_time > CANCEL_TIMEOUT:
+                self._kill(job)
+        self._start_queued()
+
+    def shutdown(self):
+        """
+        Cancel all jobs and wait for the running ones to stop.
+        """
+        for job in list(self.pending()):
+            self.cancel(job)
+        while self.running():
+            self.poll(0.1)
+
+    def _start_queued(self):
+        from video_generator import output_paths, snapshot_outputs
+
+        for job in self.jobs:
+            if len(self.running()) >= self.max_workers:
+                break
+            if job.status == QUEUED:
+                try:
+                    paths = output_paths(job.output_path, job.params.get('windows'), job.params.get('variants'))
+                except (ValueError, KeyError):
+                    # Invalid variants fail the render before it writes anything
+                    paths = [job.output_path]
+                job.outputs = snapshot_outputs(paths)
+                receiver, sender = self._context.Pipe(duplex=False)
+                job.process = self._context.Process(target=run_render_job, args=(job.params, sender), daemon=True)
+                job.process.start()
+                sender.close()
+                job.conn = receiver
+                job.status = RUNNING
+                self._notify(job, {'event': 'status', 'status': RUNNING})
+
+    def _handle(self, job, event):
+        if event['event'] == 'finished':
+            # The process exits right after; the job is finished once it is reaped
+            job.final_status = event['status']
+            return
+        if event['event'] == 'progress':
+            job.percent = event['percent']
+        elif event['event'] == 'error':
+            job.error = event['message']
+        self._notify(job, event)
+
+    def _drain(self, job):
+        try:
+            while job.conn.poll():
+                self._handle(job, job.conn.recv())
+        except (EOFError, OSError):
+            pass
+
+    def _kill(self, job):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(job.process.pid, signal.SIGKILL)
+            else:
+                job.process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _finish(self, job, status):
+        from video_generator import remove_partial_outputs
+
+        if job.process is not None:
+            job.process.join()
+            job.conn.close()
+            if status == CANCELLED:
+                # Anything left in the job's process group (ffmpeg, segment workers) goes too
+                self._kill(job)
+        if status == CANCELLED and job.outputs is not None:
+            remove_partial_outputs(job.outputs)
+        job.status = status
+        job.process = job.conn = None
+        self._notify(job, {'event': 'status', 'status': status})
+
+    def _notify(self, job, event):
+        if self.on_event:
+            self.on_event(job, event)
@@ -0,0 +1,301 @@
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch import make_job, warm_up_worker
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# generate_video options a job may set besides the manifest fields
+JOB_OPTIONS = ('engine', 'draft', 'window', 'resolution', 'resume', 'variants', 'windows')
+
+# Number of log lines kept per job
+LOG_TAIL = 50
+
+# Worker state, set by init_worker: the queue events are sent through and the ids of cancelled jobs
+_events = None
+_cancelled = None
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def init_worker(events, cancelled):
+    """
+    Pool initializer: keep the event queue and cancel set, and pay the heavy imports once.
+    """
+    global _events, _cancelled
+    _events, _cancelled = events, cancelled
+    warm_up_worker()
+
+
+def render_job(job_id, params, cache=True):
+    """
+    Worker: render one job, streaming its events to the server. Returns (success, wall time).
+
+    Workers live as long as the server, so the decoded backgrounds, fonts and cache entries
+    they keep in memory are reused by later jobs.
+    """
+    import video_generator
+
+    stopping = []
+
+    def send(event):
+        _events.put((job_id, event))
+        # Checked on every event, i.e. at least at every stage and progress update
+        if not stopping and job_id in _cancelled:
+            stopping.append(True)
+            raise JobCancelled("Render cancelled")
+
+    _events.put((job_id, {'event': 'status', 'status': 'running', 'pid': os.getpid()}))
+    start = time.perf_counter()
+    # A cancelled job removes only the outputs it wrote, not a previous render at the same path
+    outputs = video_generator.snapshot_outputs(
+        video_generator.output_paths(params['output_path'], params.get('windows'), params.get('variants')))
+    ok = video_generator.generate_video(**params, event_callback=send, cache=cache)
+    if not ok and job_id in _cancelled:
+        video_generator.remove_partial_outputs(outputs)
+    return ok, round(time.perf_counter() - start, 3)
+
+
+class RenderServer:
+    """
+    Local render service: a pool of warmed-up worker processes fed by a job queue.
+
+    Jobs are generate_video parameters; their status, progress (from the render events)
+    and result are kept for the lifetime of the server.
+    """
+
+    def __init__(self, workers=None, cache=True):
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache
+        self.jobs = {}
+        # Reentrant: cancelling a queued future runs its done callback in the cancelling thread
+        self.lock = threading.RLock()
+        self._ids = itertools.count(1)
+        # Workers are spawned so they do not inherit the server's threads
+        context = multiprocessing.get_context('spawn')
+        self.manager = context.Manager()
+        self.cancelled = self.manager.dict()
+        self.events = context.Queue()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=init_worker,
+                                            initargs=(self.events, self.cancelled))
+        self._pump = threading.Thread(target=self._pump_events, daemon=True)
+        self._pump.start()
+
+    def submit(self, params):
+        job = make_job(params, os.getcwd(), JOB_OPTIONS)
+        if isinstance(job.get('resolution'), list):
+            job['resolution'] = tuple(job['resolution'])
+        with self.lock:
+            job_id = str(next(self._ids))
+            self.jobs[job_id] = record = {
+                'id': job_id, 'status': 'queued', 'params': job, 'output_path': job['output_path'],
+                'submitted': time.time(), 'started': None, 'finished': None, 'wall_time': None, 'stage': None,
+                'percent': 0.0, 'frames': None, 'total_frames': None, 'fps': None, 'eta': None,
+                'outputs': [], 'error': None, 'log': collections.deque(maxlen=LOG_TAIL),
+            }
+        record['future'] = future = self.executor.submit(render_job, job_id, job, self.cache)
+        future.add_done_callback(lambda future: self._finished(job_id, future))
+        return self.status(job_id)
+
+    def status(self, job_id):
+        """
+        Return the JSON-serializable state of a job, or None if there is no such job.
+        """
+        with self.lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return None
+            state = {key: value for key, value in record.items() if key not in ('future', 'log')}
+            state['log'] = list(record['log'])
+            return state
+
+    def list(self):
+        with self.lock:
+            job_ids = list(self.jobs)
+        return [self.status(job_id) for job_id in job_ids]
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job. Returns its state, or None if there is no such job.
+        """
+        with self.lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return None
+            if record['status'] in ('queued', 'running'):
+                self.cancelled[job_id] = True
+                if record['future'].cancel():
+                    record['status'] = 'cancelled'
+                    record['finished'] = time.time()
+        return self.status(job_id)
+
+    def health(self):
+        with self.lock:
+            counts = collections.Counter(record['status'] for record in self.jobs.values())
+        return {'workers': self.workers, 'jobs': dict(counts)}
+
+    def shutdown(self):
+        """
+        Cancel the queued and running jobs and stop the workers.
+        """
+        with self.lock:
+            for job_id, record in self.jobs.items():
+                if record['status'] in ('queued', 'running'):
+                    self.cancelled[job_id] = True
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.events.put(None)
+        self.manager.shutdown()
+
+    def _pump_events(self):
+        while True:
+            item = self.events.get()
+            if item is None:
+                return
+            job_id, event = item
+            with self.lock:
+                record = self.jobs.get(job_id)
+                if record is not None:
+                    self._apply(record, event)
+
+    def _apply(self, record, event):
+        kind = event['event']
+        if kind == 'status' and record['status'] == 'queued':
+            record['status'] = event['status']
+            record['started'] = time.time()
+        elif kind == 'stage_start':
+            record['stage'] = event['stage']
+        elif kind == 'progress':
+            for key in ('percent', 'frames', 'total_frames', 'fps', 'eta'):
+                record[key] = event[key]
+        elif kind == 'log':
+            record['log'].append(event['message'])
+        elif kind == 'error':
+            record['error'] = event['message']
+
+    def _finished(self, job_id, future):
+        from video_generator import output_paths
+
+        with self.lock:
+            record = self.jobs[job_id]
+            params = record['params']
+            if record['status'] == 'cancelled':
+                return
+            record['finished'] = time.time()
+            try:
+                ok, record['wall_time'] = future.result()
+            except CancelledError:
+                ok = False
+            except BrokenProcessPool:
+                ok, record['error'] = False, "worker process died"
+            except Exception as e:
+                ok, record['error'] = False, str(e)
+            if ok:
+                record['status'] = 'done'
+                record['percent'] = 100.0
+                record['outputs'] = [{'path': path, 'size': os.path.getsize(path) if os.path.exists(path) else None}
+                                     for path in output_paths(params['output_path'], params.get('windows'),
+                                                              params.get('variants'))]
+            else:
+                record['status'] = 'cancelled' if job_id in self.cancelled else 'failed'
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the render server:
+
+    - POST /jobs with the generate_video fields submits a job
+    - GET /jobs lists all jobs, GET /jobs/<id> returns one job's status, progress and result
+    - DELETE /jobs/<id> cancels a job
+    - GET /health returns the number of workers and jobs per status
+    """
+
+    server_version = 'podcast-maker'
+
+    def do_GET(self):
+        if self.path == '/health':
+            return self._reply(200, self.server.render_server.health())
+        if self.path == '/jobs':
+            return self._reply(200, self.server.render_server.list())
+        job_id = self._job_id()
+        state = job_id and self.server.render_server.status(job_id)
+        if not state:
+            return self._reply(404, {'error': 'not found'})
+        self._reply(200, state)
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            return self._reply(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            state = self.server.render_server.submit(json.loads(self.rfile.read(length) or b'null'))
+        except ValueError as e:
+            return self._reply(400, {'error': str(e)})
+        self._reply(201, state)
+
+    def do_DELETE(self):
+        job_id = self._job_id()
+        state = job_id and self.server.render_server.cancel(job_id)
+        if not state:
+            return self._reply(404, {'error': 'not found'})
+        self._reply(200, state)
+
+    def _job_id(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'jobs':
+            return parts[1]
+        return None
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, cache=True):
+    # Stop on SIGTERM as on Ctrl-C, so the workers and their renders are shut down too
+    signal.signal(signal.SIGTERM, _stop)
+    render_server = RenderServer(workers, cache)
+    httpd = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    httpd.render_server = render_server
+    print(f"Render server listening on http://{host}:{httpd.server_address[1]} with {render_server.workers} workers")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        render_server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="video_generator.py serve", description="Run a local render server with a pool of warm worker processes.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default: number of CPU cores)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the render cache")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.workers, cache=not args.no_cache)
+    return 0
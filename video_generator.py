@@ -1,15 +1,29 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
 import os
+import shutil
+import tempfile
 import numpy as np
-import librosa
-import matplotlib.pyplot as plt
-from moviepy.editor import VideoFileClip, AudioFileClip, ImageClip, CompositeVideoClip, VideoClip
-from moviepy.video.io.bindings import mplfig_to_npimage
-from PIL import Image, ImageDraw, ImageFont
-import readline
 import argparse
 from concurrent.futures import ThreadPoolExecutor
 import multiprocessing
 import functools
+import sys
+
+from audio_features import bar_heights_from_mel, compute_mel_db, compute_mel_db_streaming, frame_count
+from audio_io import AudioFileInput, decode_audio
+from fonts import resolve_font
+from frame_pipe import (DEDUP_RESOLUTION, FFmpegFrameWriter, FrameCompositor, create_overlay_writer, load_background,
+                        render_video, scaled_size)
+from instrumentation import ConsoleSink, JsonLinesSink, RenderMonitor, callback_sink, make_progress_bar_logger
+from parallel_render import render_parallel, render_resumable
+from render_cache import RenderCache, make_key
+from visualization import DEFAULT_SIZE, make_bar_renderer
+
+# moviepy, PIL, librosa, matplotlib and readline are imported in the functions using them,
+# so the GUI and --help start without loading them
+IMPORT_TIME = time.perf_counter() - STARTUP_TIME
 
 # Optimization 1: Use a lower sample rate for audio processing
 SAMPLE_RATE = 22050  # Lower sample rate (default is usually 44100)
@@ -17,93 +31,517 @@ SAMPLE_RATE = 22050  # Lower sample rate (default is usually 44100)
 # Optimization 2: Reduce the number of mel bands for faster processing
 N_MELS = 64  # Reduced from the default 128
 
-# Optimization 4: Cache size for audio visualization frames
-CACHE_SIZE = 100
+# Optimization 2: Use a smaller n_fft and hop_length for faster STFT
+N_FFT = 1024
+HOP_LENGTH = 512
+
+# Frame rate of the generated video
+FPS = 24
+
+# Recordings at least this long (in seconds) are analysed with the streaming STFT
+STREAMING_MIN_DURATION = 30 * 60
+
+# Seconds of audio decoded and analysed on each side of a time window, so the analysis of
+# its first and last frames sees the same signal as in an analysis of the whole file
+WINDOW_PADDING = 1.0
+
+# Heading layer: font used when the requested font is not installed, font size, outline width and vertical offset
+DEFAULT_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"  # Adjust this path if needed
+HEADING_FONT_SIZE = 70
+HEADING_STROKE_WIDTH = 2
+HEADING_Y = 50
+
+# Shorter side in pixels of the output the full-size layout above is drawn for. With an
+# explicit output resolution the visualization and heading are scaled by resolution / this.
+LAYOUT_SIZE = 1080
+
+# Encoder settings an output variant may override
+VARIANT_OPTIONS = ('crf', 'preset', 'bitrate')
+
+# Named output resolutions (width, height) accepted besides WIDTHxHEIGHT
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    'square': (1080, 1080),
+    'vertical': (1080, 1920),
+}
+
+# Optimization 6: Video writing parameters
+VIDEO_CODEC = 'libx264'
+VIDEO_PRESET = 'faster'
+VIDEO_BITRATE = '5000k'
+VIDEO_CRF = 23
+AUDIO_CODEC = 'aac'
+
+# Output engines: raw frames piped to ffmpeg, only the visualization piped to ffmpeg and
+# composited there, or moviepy's CompositeVideoClip as a fallback
+ENGINES = ("pipe", "overlay", "moviepy")
+
+# Draft renders: a short window at reduced size and frame rate with the fastest encoder settings
+DRAFT_SCALE = 0.5
+DRAFT_FPS = 12
+DRAFT_DURATION = 10
+DRAFT_PRESET = 'ultrafast'
+DRAFT_CRF = 32
+
+def analysis_params():
+    """
+    Parameters the mel spectrogram depends on, part of its cache key.
+    """
+    return dict(sample_rate=SAMPLE_RATE, n_mels=N_MELS, n_fft=N_FFT, hop_length=HOP_LENGTH)
+
+def compute_mel_spectrogram(audio, duration, monitor=None, streaming=None):
+    """
+    Compute the mel spectrogram in dB (N_MELS x n_frames) of a DecodedAudio buffer.
 
-def create_audio_visualization(audio_path, duration, wave_color, progress_callback=None):
-    if progress_callback:
-        progress_callback(10)
-    print(f"Loading audio file: {audio_path}")
+    `streaming` selects the bounded-memory analysis; by default it is used for recordings
+    longer than STREAMING_MIN_DURATION. Stage timings and messages go to `monitor`.
+    """
+    monitor = monitor or RenderMonitor([ConsoleSink()])
     try:
-        # Optimization 1: Load audio with lower sample rate
-        y, sr = librosa.load(audio_path, sr=SAMPLE_RATE)
-        if progress_callback:
-            progress_callback(20)
-        print(f"Audio loaded successfully. Sample rate: {sr}, Length: {len(y)}")
-        
-        # Optimization 2: Use a smaller n_fft and hop_length for faster STFT
-        n_fft = 1024
-        hop_length = 512
-        D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
-        mag, _ = librosa.magphase(D)
-        
-        # Optimization 2: Use fewer mel bands
-        mel = librosa.feature.melspectrogram(S=mag, sr=sr, n_mels=N_MELS)
-        mel_db = librosa.power_to_db(mel, ref=np.max)
-        if progress_callback:
-            progress_callback(30)
-        print("Audio processing completed successfully")
+        # Optimization 1: Analyse the audio at a lower sample rate
+        sr = SAMPLE_RATE
+        with monitor.stage("resample"):
+            y = audio.analysis_signal(sr)
+        monitor.log(f"Audio loaded successfully. Sample rate: {sr}, Length: {len(y)}")
+
+        if streaming is None:
+            streaming = duration >= STREAMING_MIN_DURATION
+        with monitor.stage("mel"):
+            if streaming:
+                # Long recordings are analysed block by block into an on-disk array, so peak
+                # memory does not grow with the episode length
+                monitor.log("Using streaming audio analysis")
+                mel_db = compute_mel_db_streaming(y, sr, N_FFT, HOP_LENGTH, N_MELS, os.path.join(audio.workdir, 'mel_db.npy'))
+            else:
+                mel_db = compute_mel_db(y, sr, N_FFT, HOP_LENGTH, N_MELS)
+        monitor.log("Audio processing completed successfully")
     except Exception as e:
-        print(f"Error processing audio file: {str(e)}")
+        monitor.log(f"Error processing audio file: {str(e)}")
+        raise
+    return mel_db
+
+def load_audio_features(audio_path, cache=None, monitor=None, streaming=None, window=None):
+    """
+    Return (audio, mel_db): the audio to mux into the video and its mel spectrogram.
+
+    With a RenderCache, the spectrogram is looked up by the content hash of the file and the
+    analysis parameters. On a hit the file is neither decoded nor analysed again: the
+    cached array is memory-mapped and the file is muxed straight from disk.
+
+    With a `window` (start, end) in seconds the cached analysis of the whole file is used
+    when there is one, so a draft or clip has the levels of the preview and the full render.
+    Otherwise only that span of the file and WINDOW_PADDING around it are decoded and
+    analysed, so the cost does not grow with the file length. The spectrogram then starts at
+    audio.offset and, as the loudest moment of the file is not known, its levels are
+    relative to the loudest moment of the span.
+    """
+    monitor = monitor or RenderMonitor([ConsoleSink()])
+    key = None
+    if cache is not None:
+        with monitor.stage("cache_lookup"):
+            # For a window a file that was never hashed is not read in full just to look up
+            # an analysis that cannot be cached
+            digest = cache.digest(audio_path, compute=window is None)
+            if digest is not None:
+                key = make_key('mel', audio=digest, **analysis_params())
+                mel_db = cache.load_array(key)
+                meta = cache.load_meta(key)
+        if key is not None and mel_db is not None and meta is not None:
+            monitor.log("Using cached audio analysis")
+            return AudioFileInput(audio_path, meta['duration']), mel_db
+
+    start, duration = 0.0, None
+    if window is not None:
+        if window[0] < 0 or window[1] <= window[0]:
+            raise ValueError(f"Invalid time window {window[0]}-{window[1]}s")
+        # Aligned to a hop, so the mel frames of the span are frames of the whole file's analysis
+        start = int(max(window[0] - WINDOW_PADDING, 0) * SAMPLE_RATE / HOP_LENGTH) * HOP_LENGTH / SAMPLE_RATE
+        if window[1] != float('inf'):
+            duration = window[1] + WINDOW_PADDING - start
+        monitor.log(f"Decoding {window[0]}-{window[1]}s of the audio")
+    with monitor.stage("decode"):
+        audio = decode_audio(audio_path, start=start, duration=duration)
+    try:
+        mel_db = compute_mel_spectrogram(audio, audio.duration, monitor, streaming)
+        if cache is not None and window is None:
+            cache.store_array(key, mel_db, {'duration': audio.duration})
+    except Exception:
+        audio.close()
         raise
+    return audio, mel_db
+
+def bar_heights_for_video(mel_db, duration, fps=FPS, smoothing=0.0, window=None, offset=0.0):
+    """
+    Return the bar-height matrix of the video, or of the frames within `window` (start, end) seconds.
+
+    `offset` is the time in seconds the spectrogram starts at, when it covers only a span
+    of the audio (see load_audio_features).
+    """
+    # Optimization 3: Resample the spectrum to one row of bar values per video frame in a
+    # single vectorized pre-pass, so rendering a frame is an integer index into the matrix
+    first, last = frame_range(duration, fps, window)
+    return bar_heights_from_mel(mel_db, SAMPLE_RATE, HOP_LENGTH, fps, last - first, smoothing, start_frame=first,
+                                mel_offset=int(round(offset * SAMPLE_RATE / HOP_LENGTH)))
 
-    # Optimization 3: Pre-compute angles for faster frame generation
-    angles = np.linspace(0, 2*np.pi, num=N_MELS, endpoint=False)
-
-    # Optimization 4: Implement frame caching
-    @functools.lru_cache(maxsize=CACHE_SIZE)
-    def make_frame_cached(t):
-        fig, ax = plt.subplots(figsize=(10, 10), subplot_kw=dict(projection='polar'))
-        time_index = int(t * sr / hop_length)
-        values = mel_db[:, time_index] + 40
-        
-        ax.bar(angles, values, color=wave_color, alpha=0.8, width=2*np.pi/N_MELS)
-        
-        ax.set_ylim(0, 80)
-        ax.set_yticks([])
-        ax.set_xticks([])
-        ax.spines['polar'].set_visible(False)
-        fig.patch.set_alpha(0)
-        ax.set_facecolor('none')
-        
-        img = mplfig_to_npimage(fig)
-        plt.close(fig)
-        return img
-
-    # Create circular audio visualization with bars
+def frame_range(duration, fps, window=None):
+    """
+    Return the [first, last) video frames covering `window` (start, end) seconds of the audio, or all of it.
+    """
+    n_frames = frame_count(duration, fps)
+    if window is None:
+        return 0, n_frames
+    start, end = window
+    if start < 0 or end <= start or start >= duration:
+        raise ValueError(f"Invalid time window {start}-{end}s for {duration:.2f}s of audio")
+    first = min(int(round(start * fps)), n_frames - 1)
+    return first, max(min(frame_count(min(end, duration), fps), n_frames), first + 1)
+
+def create_visualization_clip(bar_heights, duration, wave_color, fps=FPS, backend="numpy", size=DEFAULT_SIZE):
+    """
+    Create the circular bar visualization clip from a bar-height matrix.
+    """
+    from moviepy.video.VideoClip import VideoClip
+
+    # Optimization 4: Pre-compute the polar geometry of the bars once and render frames
+    # with vectorized array operations instead of building a matplotlib figure per frame
+    renderer = make_bar_renderer(wave_color, N_MELS, size, backend=backend)
+
+    # The color and mask clips ask for the same frame one after the other, and consecutive
+    # frames often repeat (silence), so keep the last frame by its quantized bar values
+    last_frame = {}
+
+    def render_frame(t):
+        values = bar_heights[min(int(t * fps + 0.5), len(bar_heights) - 1)]
+        key = np.rint(values * np.float32(1 / DEDUP_RESOLUTION)).tobytes()
+        if last_frame.get('key') != key:
+            last_frame['key'] = key
+            last_frame['frame'] = renderer.render(values)
+        return last_frame['frame']
+
+    # Create circular audio visualization with bars. The bars are drawn on a transparent
+    # canvas, so the alpha channel becomes the clip's mask.
     def make_frame(t):
-        return make_frame_cached(round(t, 2))  # Round to 2 decimal places for better caching
+        return render_frame(t)[:, :, :3]
+
+    def make_mask_frame(t):
+        return render_frame(t)[:, :, 3] / 255.0
 
-    return VideoClip(make_frame, duration=duration)
+    mask = VideoClip(make_mask_frame, ismask=True, duration=duration)
+    return VideoClip(make_frame, duration=duration).set_mask(mask)
+
+@functools.lru_cache(maxsize=16)
+def load_font(font_path, font_size):
+    """
+    Load a TrueType font once per process and size.
+    """
+    from PIL import ImageFont
+    return ImageFont.truetype(font_path, font_size)
+
+def render_text_image(text, font_path, font_size, color, stroke_color, stroke_width, size):
+    """
+    Render the heading text with its outline on a transparent RGBA image of the given size.
+    """
+    from PIL import Image, ImageDraw
 
-def create_text_clip(text, font_path, font_size, color, stroke_color, stroke_width, size):
-    # Optimization 5: Create text image only once
     img = Image.new('RGBA', size, (255, 255, 255, 0))
     draw = ImageDraw.Draw(img)
-    font = ImageFont.truetype(font_path, font_size)
+    font = load_font(font_path, font_size)
     left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
     text_width = right - left
     text_height = bottom - top
     position = ((size[0] - text_width) / 2, (size[1] - text_height) / 2)
 
-    for adj in range(-stroke_width, stroke_width+1):
-        for opp in range(-stroke_width, stroke_width+1):
-            draw.text((position[0]+adj, position[1]+opp), text, font=font, fill=stroke_color)
+    # The outline is drawn by FreeType's stroker in the same pass as the text
+    draw.text(position, text, font=font, fill=color, stroke_width=stroke_width, stroke_fill=stroke_color)
+    return img
+
+def create_heading_image(text, font_path, font_size, color, stroke_color, stroke_width, size, cache=None):
+    """
+    Return the rendered heading image, from the cache when it was rendered with the same parameters before.
+    """
+    if cache is None:
+        return render_text_image(text, font_path, font_size, color, stroke_color, stroke_width, size)
+    key = make_key('heading', text=text, font=cache.digest(font_path), font_size=font_size, color=color,
+                   stroke_color=stroke_color, stroke_width=stroke_width, size=list(size))
+    img = cache.load_image(key)
+    if img is None:
+        img = render_text_image(text, font_path, font_size, color, stroke_color, stroke_width, size)
+        cache.store_image(key, img)
+    return img
+
+def create_frame_compositor(background, heading_image, renderer, heading_y=HEADING_Y):
+    """
+    Create the compositor of the pipe engine: heading centered at `heading_y`, visualization at the top left.
+    """
+    heading = np.array(heading_image.convert('RGBA'))
+    heading_position = ((background.shape[1] - heading.shape[1]) // 2, heading_y)
+    return FrameCompositor(background, heading, heading_position, renderer.size, (0, 0), renderer.bbox)
+
+def overlay_output(output_path, background, heading_image, renderer, heading_y=HEADING_Y, **encoder):
+    """
+    Describe one output file of the overlay engine: its layers in the pipe engine's layout
+    and its `encoder` options (see create_overlay_writer).
+    """
+    heading = np.array(heading_image.convert('RGBA'))
+    heading_position = ((background.shape[1] - heading.shape[1]) // 2, heading_y)
+    return dict(output_path=output_path, background=background, heading=heading, heading_position=heading_position,
+                color=renderer.color, vis_bbox=renderer.bbox, **encoder)
+
+def create_frame_writer(engine, output_path, background, heading_image, renderer, compositor, fps, workdir,
+                        heading_y=HEADING_Y, audio_input_args=None, audio_codec=AUDIO_CODEC, **encoder):
+    """
+    Return (compositor, writer) for the "pipe" engine (full frames composited in Python) or
+    the "overlay" engine (only the visualization piped, composited by ffmpeg in the same
+    layout). `workdir` holds the overlay engine's images; `encoder` options go to the writer.
+    """
+    if engine == "overlay":
+        output = overlay_output(output_path, background, heading_image, renderer, heading_y, **encoder)
+        return create_overlay_writer([output], renderer.bbox, fps, workdir, audio_input_args=audio_input_args,
+                                     audio_codec=audio_codec)
+    return compositor, FFmpegFrameWriter(output_path, compositor.size, fps, audio_input_args=audio_input_args,
+                                         audio_codec=audio_codec, **encoder)
+
+def parse_resolution(value):
+    """
+    Parse an output resolution: a name from RESOLUTIONS or WIDTHxHEIGHT. Returns (width, height).
+    """
+    if value in RESOLUTIONS:
+        return RESOLUTIONS[value]
+    try:
+        width, height = (int(side) for side in value.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Invalid resolution: {value} (use WIDTHxHEIGHT or one of {', '.join(RESOLUTIONS)})")
+    if width < 2 or height < 2 or width % 2 or height % 2:
+        raise ValueError(f"Invalid resolution: {value} (width and height must be even and at least 2)")
+    return width, height
+
+def parse_time(value):
+    """
+    Parse a time in seconds, given as seconds or [HH:]MM:SS(.fraction).
+    """
+    try:
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise ValueError(f"Invalid time: {value}")
+    return seconds
+
+def parse_window(spec):
+    """
+    Parse a time window "START-END" (times as for parse_time), e.g. 1:02:30-1:03:15. Returns (start, end).
+    """
+    start, sep, end = spec.partition('-')
+    if not sep:
+        raise ValueError(f"Invalid time window: {spec} (use START-END)")
+    return parse_time(start), parse_time(end)
+
+def clip_path(output_path, index, count):
+    """
+    Return the output path of clip `index` (from 0) of `count`: output_path itself for a single
+    clip, else output_path with the clip number, e.g. episode-2.mp4.
+    """
+    if count == 1:
+        return output_path
+    root, ext = os.path.splitext(output_path)
+    return f"{root}-{index + 1}{ext}"
+
+def output_paths(output_path, windows=(), variants=()):
+    """
+    Return the files generate_video writes for `output_path`, `windows` and `variants`: the
+    output path or the numbered clips of the windows (see clip_path), then the variant outputs.
+    """
+    count = len(windows or ())
+    paths = [clip_path(output_path, index, count) for index in range(count)] or [output_path]
+    for variant in variants or ():
+        variant = parse_variant(variant) if isinstance(variant, str) else variant
+        paths.append(os.path.expanduser(variant['output_path']))
+    return paths
+
+def snapshot_outputs(paths):
+    """
+    Return {path: (inode, mtime, size) or None} of output files, taken before a render starts
+    so that remove_partial_outputs can tell the files it wrote from files that were already there.
+    """
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            snapshot[path] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            snapshot[path] = None
+    return snapshot
+
+def remove_partial_outputs(snapshot):
+    """
+    Delete the outputs of a cancelled render that were created or rewritten since `snapshot`
+    (see snapshot_outputs). Files it never opened, e.g. a previous render, are kept.
+    """
+    for path, state in snapshot_outputs(snapshot).items():
+        if state is not None and state != snapshot[path]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def parse_variant(spec):
+    """
+    Parse an output variant "RESOLUTION:PATH[:OPTION=VALUE...]", the options being the
+    encoder settings crf, preset and bitrate. Returns a variant dict for generate_video.
+    """
+    parts = spec.split(':')
+    if len(parts) < 2 or not parts[1]:
+        raise ValueError(f"Invalid variant: {spec} (use RESOLUTION:PATH[:crf=N][:preset=NAME][:bitrate=RATE])")
+    variant = {'resolution': parse_resolution(parts[0]), 'output_path': parts[1]}
+    for option in parts[2:]:
+        name, _, value = option.partition('=')
+        if name not in VARIANT_OPTIONS or not value:
+            raise ValueError(f"Invalid variant option: {option} (use one of {', '.join(VARIANT_OPTIONS)})")
+        if name == 'crf' and not value.isdigit():
+            raise ValueError(f"Invalid variant option: {option} (crf must be an integer)")
+        variant[name] = int(value) if name == 'crf' else value
+    return variant
+
+def layout_scale(resolution=None):
+    """
+    Return the factor the full-size layout is scaled by for an output `resolution`
+    (the background's own size, i.e. the full-size layout, when None).
+    """
+    if resolution is None:
+        return 1.0
+    return min(resolution) / LAYOUT_SIZE
+
+def heading_font(font, log=None):
+    """
+    Return the font file for the heading font name or path `font`, DEFAULT_FONT_PATH if it
+    is not installed (reported to `log`).
+    """
+    font_path = resolve_font(font)
+    if font_path is None:
+        font_path = DEFAULT_FONT_PATH
+        if font and log:
+            log(f"Font not found: {font}, using {font_path}")
+    return font_path
+
+def create_layers(image_path, heading_text, heading_color, outline_color, wave_color, scale=1.0, cache=None, resolution=None,
+                  font_path=DEFAULT_FONT_PATH):
+    """
+    Return (background, heading_image, renderer, compositor, heading_y) for frames scaled by `scale`.
+
+    With an output `resolution` the background is resized and cropped to it, and the layout
+    is scaled to it (see layout_scale). Otherwise frames have the background's size and the
+    full-size layout. `scale` then shrinks background, visualization canvas, heading font,
+    outline and offset by the same factor.
+    """
+    if resolution is not None:
+        background = load_background(image_path, size=scaled_size(resolution, scale))
+        scale *= layout_scale(resolution)
+    else:
+        background = load_background(image_path, scale)
+    background_size = (background.shape[1], background.shape[0])
+    heading_image = create_heading_image(heading_text, font_path, max(int(round(HEADING_FONT_SIZE * scale)), 1),
+                                         heading_color, outline_color, int(round(HEADING_STROKE_WIDTH * scale)),
+                                         background_size, cache)
+    renderer = make_bar_renderer(wave_color, N_MELS, scaled_size(DEFAULT_SIZE, scale))
+    heading_y = int(round(HEADING_Y * scale))
+    compositor = create_frame_compositor(background, heading_image, renderer, heading_y)
+    return background, heading_image, renderer, compositor, heading_y
+
+def encoder_threads():
+    # Optimization 6: Use all available cores except one for encoding
+    return max(multiprocessing.cpu_count() - 1, 1)
+
+def compose_video(background, audio_vis, heading, heading_y=HEADING_Y):
+    """
+    Stack the background, the audio visualization and the heading into the final video clip.
+    """
+    from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+    return CompositeVideoClip([background, audio_vis, heading.set_position(('center', heading_y))])
 
-    draw.text(position, text, font=font, fill=color)
-    return ImageClip(np.array(img))
+def preview_frame(audio_path, image_path, heading_text, font, heading_color, outline_color, wave_color, t=0.0, scale=1.0, cache=True, resolution=None):
+    """
+    Return the composited RGB frame (a uint8 array) of the video at time `t`, at the output
+    `resolution` scaled by `scale`, without writing a video.
 
-def generate_video(audio_path, image_path, heading_text, font, heading_color, outline_color, wave_color, output_path, progress_callback=None, log_callback=None):
+    With the cache the audio analysis is only computed on the first call for a file, so
+    previews of other times, colors or headings take milliseconds.
+    """
+    if cache is True:
+        cache = RenderCache()
+    cache = cache or None
+    audio, mel_db = load_audio_features(os.path.expanduser(audio_path), cache, RenderMonitor())
+    try:
+        index = min(max(int(t * FPS + 0.5), 0), frame_count(audio.duration, FPS) - 1)
+        values = bar_heights_from_mel(mel_db, SAMPLE_RATE, HOP_LENGTH, FPS, 1, start_frame=index)[0]
+    finally:
+        audio.close()
+    _, _, renderer, compositor, _ = create_layers(os.path.expanduser(image_path), heading_text, heading_color,
+                                               outline_color, wave_color, scale, cache, resolution, heading_font(font))
+    return compositor.compose(renderer.render(values)).copy()
+
+def generate_video(audio_path, image_path, heading_text, font, heading_color, outline_color, wave_color, output_path, progress_callback=None, log_callback=None, segments=1, workers=None, engine="pipe", cache=True, events_path=None, event_callback=None, draft=False, window=None, resolution=None, resume=False, chunk_dir=None, variants=(), windows=()):
+    """
+    Generate the video.
+
+    With `draft` a quick draft is rendered instead: DRAFT_DURATION seconds (or `window`) at
+    DRAFT_SCALE of the size, DRAFT_FPS and the fastest encoder settings. `window` is a
+    (start, end) time range in seconds to render instead of the whole audio; only that span
+    of the audio is decoded and analysed. `windows` are several such ranges, each rendered to
+    its own clip (see clip_path) with the layers prepared once; they may be given as
+    "START-END" strings (see parse_window).
+
+    `font` is the heading font: a font name looked up in the index of the installed fonts
+    (see fonts.font_index) or a font file; DEFAULT_FONT_PATH is used if it is not installed.
+
+    `resolution` is the output (width, height), or a name or WIDTHxHEIGHT string (see
+    parse_resolution). The background is resized and cropped to it and the visualization
+    and heading are scaled to it; by default the video has the background image's size.
+
+    With `cache` (the default) the audio analysis and the heading layer are reused from the
+    on-disk RenderCache when the same inputs were rendered before; pass False to bypass it
+    or a RenderCache instance to use a specific one.
+
+    Progress is reported as structured events (see instrumentation.RenderMonitor): stage
+    timings, frames rendered, fps, ETA and bytes written. They drive `progress_callback`
+    (percent of frames rendered) and `log_callback` (messages), are passed as dicts to
+    `event_callback` and appended as JSON lines to `events_path`. Without either callback
+    they are printed.
+
+    Errors are reported through `log_callback`; returns True if the video was generated.
+
+    `engine` selects the output engine: "pipe" (default) composites into a reused buffer and
+    writes raw frames straight into ffmpeg, "overlay" only pipes the visualization and lets
+    ffmpeg composite it, "moviepy" uses CompositeVideoClip and
+    write_videofile. With `segments` greater than 1 the frames are rendered in that many
+    keyframe-aligned segments on a pool of `workers` processes and joined without re-encoding.
+
+    With `resume` the video is rendered in chunks kept in `chunk_dir` (default: the output
+    path + ".chunks") on `workers` processes (default: 1), so running the same render again
+    after a crash or cancel only renders the chunks that are missing (see render_resumable).
+
+    `variants` are further outputs written in the same pass, e.g. a 720p and a square cut:
+    dicts with "output_path", "resolution" and optionally VARIANT_OPTIONS encoder settings,
+    or strings for parse_variant. The audio analysis and the visualization are computed once
+    and a single ffmpeg process composites and encodes every output (overlay engine).
+    """
+    sinks = [callback_sink(progress_callback, log_callback)]
+    if not log_callback and not event_callback:
+        sinks.append(ConsoleSink())
+    if event_callback:
+        sinks.append(event_callback)
+    events_log = JsonLinesSink(events_path) if events_path else None
+    if events_log:
+        sinks.append(events_log)
+    monitor = RenderMonitor(sinks, output_path)
+
+    audio = None
     try:
         audio_path = os.path.expanduser(audio_path)
         image_path = os.path.expanduser(image_path)
 
-        if log_callback:
-            log_callback(f"Audio path: {audio_path}")
-            log_callback(f"Image path: {image_path}")
-        else:
-            print(f"Audio path: {audio_path}")
-            print(f"Image path: {image_path}")
+        monitor.log(f"Audio path: {audio_path}")
+        monitor.log(f"Image path: {image_path}")
 
         if not os.path.exists(audio_path):
             raise ValueError(f"Audio file not found: {audio_path}")
@@ -111,75 +549,157 @@ def generate_video(audio_path, image_path, heading_text, font, heading_color, ou
             raise ValueError(f"Background image not found: {image_path}")
         if not heading_text:
             raise ValueError("Heading text is required")
-
-        if log_callback:
-            log_callback("Loading audio file...")
-        else:
-            print("Loading audio file...")
-        audio = AudioFileClip(audio_path)
-        audio_duration = audio.duration
-        if log_callback:
-            log_callback(f"Audio duration: {audio_duration}")
-        else:
-            print(f"Audio duration: {audio_duration}")
-
-        if log_callback:
-            log_callback("Creating background...")
-        else:
-            print("Creating background...")
-        background = ImageClip(image_path).set_duration(audio_duration)
-        if progress_callback:
-            progress_callback(40)
-
-        if log_callback:
-            log_callback("Creating audio visualization...")
-        else:
-            print("Creating audio visualization...")
-        audio_vis = create_audio_visualization(audio_path, audio_duration, wave_color, progress_callback)
-        if progress_callback:
-            progress_callback(60)
-
-        if log_callback:
-            log_callback("Creating heading text...")
-        else:
-            print("Creating heading text...")
-        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"  # Adjust this path if needed
-        heading = create_text_clip(heading_text, font_path, 70, heading_color, outline_color, 2, background.size)
-        heading = heading.set_duration(audio_duration)
-        if progress_callback:
-            progress_callback(70)
-
-        if log_callback:
-            log_callback("Composing video...")
-        else:
-            print("Composing video...")
-        video = CompositeVideoClip([background, audio_vis, heading.set_position(('center', 50))])
-        video = video.set_audio(audio)
-        if progress_callback:
-            progress_callback(80)
-
-        if log_callback:
-            log_callback(f"Writing video file to {output_path}...")
-        else:
-            print(f"Writing video file to {output_path}...")
-        
-        # Optimization 6: Adjust video writing parameters
-        n_threads = max(multiprocessing.cpu_count() - 1, 1)  # Use all available cores except one
-        video.write_videofile(output_path, fps=24, threads=n_threads, audio_codec='aac', 
-                              bitrate='5000k', preset='faster', ffmpeg_params=['-crf', '23'])
-        
-        if progress_callback:
-            progress_callback(100)
-        if log_callback:
-            log_callback(f"Video generated successfully: {output_path}")
-        else:
-            print(f"Video generated successfully: {output_path}")
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown output engine: {engine}")
+        if isinstance(resolution, str):
+            resolution = parse_resolution(resolution)
+
+        fps, scale = FPS, 1.0
+        preset, crf, bitrate = VIDEO_PRESET, VIDEO_CRF, VIDEO_BITRATE
+        if draft:
+            fps, scale = DRAFT_FPS, DRAFT_SCALE
+            preset, crf, bitrate = DRAFT_PRESET, DRAFT_CRF, None
+            engine, segments, resume = "pipe", 1, False
+            if not windows:
+                window = window or (0, DRAFT_DURATION)
+        windows = [parse_window(window) if isinstance(window, str) else tuple(window) for window in windows or ()]
+        if windows and window is not None:
+            raise ValueError("Pass either a time window or a list of windows")
+        if (window is not None or windows) and (engine == "moviepy" or segments > 1 or resume):
+            raise ValueError("A time window can only be rendered by the pipe or overlay engine in a single segment")
+        clips = [(window, output_path)]
+        if windows:
+            clips = [(window, clip_path(output_path, index, len(windows))) for index, window in enumerate(windows)]
+        variants = [parse_variant(variant) if isinstance(variant, str) else dict(variant) for variant in variants or ()]
+        if variants:
+            if segments > 1 or resume or len(clips) > 1:
+                raise ValueError("Output variants are rendered in a single pass, not in segments, chunks or several clips")
+            for variant in variants:
+                if isinstance(variant.get('resolution'), str):
+                    variant['resolution'] = parse_resolution(variant['resolution'])
+                unknown = set(variant) - {'output_path', 'resolution'} - set(VARIANT_OPTIONS)
+                if not variant.get('output_path') or unknown:
+                    raise ValueError(f"Invalid variant: {variant}")
+                variant['output_path'] = os.path.expanduser(variant['output_path'])
+            # Only ffmpeg compositing can feed several outputs from one visualization pass
+            engine = "overlay"
+
+        if cache is True:
+            cache = RenderCache()
+        cache = cache or None
+
+        monitor.log("Creating background and heading text...")
+        with monitor.stage("layers"):
+            font_path = heading_font(font, monitor.log)
+            background, heading_image, renderer, compositor, heading_y = create_layers(
+                image_path, heading_text, heading_color, outline_color, wave_color, scale, cache, resolution, font_path)
+            variant_layers = [
+                create_layers(image_path, heading_text, heading_color, outline_color, wave_color, scale, cache,
+                              variant.get('resolution'), font_path)
+                for variant in variants
+            ]
+
+        for window, output_path in clips:
+            monitor.output_path = output_path
+            monitor.log("Loading audio file...")
+            # Decode the audio once; the same PCM buffer feeds the analysis and the final mux.
+            # With a cached analysis of the whole file the audio is not decoded at all, else for a
+            # time window only that span of the file is decoded and analysed.
+            audio, mel_db = load_audio_features(audio_path, cache, monitor, window=window)
+            # End of the decoded span in the file, i.e. the whole audio's duration without a window
+            audio_duration = audio.offset + audio.duration
+            monitor.log(f"Audio duration: {audio_duration}")
+
+            monitor.log("Creating audio visualization...")
+            with monitor.stage("bar_heights"):
+                bar_heights = bar_heights_for_video(mel_db, audio_duration, fps, window=window, offset=audio.offset)
+            del mel_db
+
+            reused = 0
+            if resume:
+                monitor.log(f"Writing video file to {output_path} in resumable chunks...")
+                with monitor.stage("render"):
+                    monitor.start_frames(len(bar_heights))
+                    reused = render_resumable(bar_heights, image_path, heading_image, wave_color, audio_duration, output_path,
+                                              audio, FPS, chunk_dir or output_path + '.chunks', workers or 1, engine=engine,
+                                              codec=VIDEO_CODEC, preset=VIDEO_PRESET, bitrate=VIDEO_BITRATE, crf=VIDEO_CRF,
+                                              audio_codec=AUDIO_CODEC, log=monitor.log, progress=monitor.add_frames,
+                                              resolution=resolution)
+            elif segments > 1:
+                monitor.log(f"Writing video file to {output_path} in {segments} segments...")
+                with monitor.stage("render"):
+                    monitor.start_frames(len(bar_heights))
+                    reused = render_parallel(bar_heights, image_path, heading_image, wave_color, audio_duration, output_path, audio,
+                                             FPS, segments, workers, engine=engine, codec=VIDEO_CODEC, preset=VIDEO_PRESET,
+                                             bitrate=VIDEO_BITRATE, crf=VIDEO_CRF, audio_codec=AUDIO_CODEC, log=monitor.log,
+                                             progress=monitor.add_frames, resolution=resolution)
+            elif engine in ("pipe", "overlay"):
+                monitor.log(f"Writing video file to {output_path}...")
+                audio_input_args = audio.ffmpeg_input_args()
+                if window is not None:
+                    audio_input_args = audio.ffmpeg_input_args(frame_range(audio_duration, fps, window)[0] / fps,
+                                                               len(bar_heights) / fps)
+                workdir = tempfile.mkdtemp(prefix='podcast-maker-')
+                try:
+                    with monitor.stage("render"):
+                        monitor.start_frames(len(bar_heights))
+                        encoder = dict(codec=VIDEO_CODEC, preset=preset, bitrate=bitrate, crf=crf, threads=encoder_threads())
+                        if variants:
+                            monitor.log(f"Also writing {', '.join(variant['output_path'] for variant in variants)}...")
+                            outputs = [overlay_output(output_path, background, heading_image, renderer, heading_y, **encoder)]
+                            for variant, (v_background, v_heading_image, v_renderer, _, v_heading_y) in zip(variants, variant_layers):
+                                options = {name: variant[name] for name in VARIANT_OPTIONS if name in variant}
+                                outputs.append(overlay_output(variant['output_path'], v_background, v_heading_image,
+                                                              v_renderer, v_heading_y, **dict(encoder, **options)))
+                            # The visualization is rendered once, at the largest size any output needs
+                            renderer = max([renderer] + [layers[2] for layers in variant_layers],
+                                           key=lambda r: r.size[0] * r.size[1])
+                            compositor, writer = create_overlay_writer(outputs, renderer.bbox, fps, workdir,
+                                                                       audio_input_args=audio_input_args,
+                                                                       audio_codec=AUDIO_CODEC)
+                        else:
+                            compositor, writer = create_frame_writer(
+                                engine, output_path, background, heading_image, renderer, compositor, fps, workdir,
+                                heading_y, audio_input_args, AUDIO_CODEC, **encoder)
+                        with writer:
+                            reused = render_video(bar_heights, renderer, compositor, writer, progress=monitor.add_frames)
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+            else:
+                from moviepy.video.VideoClip import ImageClip
+
+                monitor.log("Composing video...")
+                with monitor.stage("compose"):
+                    video = compose_video(ImageClip(background).set_duration(audio_duration),
+                                          create_visualization_clip(bar_heights, audio_duration, wave_color, size=renderer.size),
+                                          ImageClip(np.array(heading_image)).set_duration(audio_duration), heading_y)
+                    video = video.set_audio(audio.to_audio_clip())
+
+                monitor.log(f"Writing video file to {output_path}...")
+                with monitor.stage("render"):
+                    monitor.start_frames(len(bar_heights))
+                    video.write_videofile(output_path, fps=FPS, threads=encoder_threads(), codec=VIDEO_CODEC, audio_codec=AUDIO_CODEC,
+                                          bitrate=VIDEO_BITRATE, preset=VIDEO_PRESET, ffmpeg_params=['-crf', str(VIDEO_CRF)],
+                                          logger=make_progress_bar_logger(monitor))
+
+            if reused:
+                monitor.count('frames_reused', reused)
+                monitor.log(f"Reused {reused} of {len(bar_heights)} frames repeating the previous frame")
+            monitor.log(f"Video generated successfully: {output_path}")
+            audio.close()
+            audio = None
+        monitor.finish()
+        return True
 
     except Exception as e:
-        if log_callback:
-            log_callback(f"Error: {str(e)}")
-        else:
-            print(f"Error: {str(e)}")
+        monitor.log(f"Error: {str(e)}")
+        monitor.fail(e)
+        return False
+    finally:
+        if audio is not None:
+            audio.close()
+        if events_log:
+            events_log.close()
 
 def path_completer(text, state):
     """
@@ -217,6 +737,8 @@ def setup_autocomplete():
     """
     Set up the readline completer for path autocomplete.
     """
+    import readline
+
     readline.set_completer_delims(' \t\n;')
     readline.parse_and_bind("tab: complete")
     readline.set_completer(path_completer)
@@ -250,7 +772,25 @@ def prompt_for_missing_args(args):
         args.output_path = input_with_autocomplete("Enter the output video file path (default: output.mp4): ") or "output.mp4"
     return args
 
+def report_startup_time(label):
+    """
+    Print how long the imports took and how long it has been since the process started importing.
+    """
+    print(f"{label}: imports took {IMPORT_TIME * 1000:.0f} ms, "
+          f"ready after {(time.perf_counter() - STARTUP_TIME) * 1000:.0f} ms")
+
 def main():
+    if "--startup-timing" in sys.argv:
+        sys.argv.remove("--startup-timing")
+        report_startup_time("video_generator.py")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        import batch
+        return batch.main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        import render_server
+        return render_server.main(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description="Generate a video with audio visualization and text overlay.")
     parser.add_argument("--audio_path", help="Path to the audio file")
     parser.add_argument("--image_path", help="Path to the background image")
@@ -260,11 +800,36 @@ def main():
     parser.add_argument("--outline_color", default="#000000", help="Color of the heading text outline")
     parser.add_argument("--wave_color", default="#FF0000", help="Color of the audio wave")
     parser.add_argument("--output_path", default="output.mp4", help="Output video file path")
+    parser.add_argument("--engine", choices=ENGINES, default="pipe", help="Output engine: pipe raw frames to ffmpeg, pipe only the visualization and let ffmpeg overlay it, or compose with moviepy (default: pipe)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the render cache")
+    parser.add_argument("--clear-cache", action="store_true", help="Empty the render cache before rendering (exits if no audio path is given)")
+    parser.add_argument("--segments", type=int, default=1, help="Render the video in this many segments in parallel (default: 1)")
+    parser.add_argument("--workers", type=int, help="Number of worker processes for segmented or resumable rendering (default: one per segment, up to the CPU count; 1 with --resume)")
+    parser.add_argument("--variant", action="append", default=[], help="Also write this output in the same pass: RESOLUTION:PATH[:crf=N][:preset=NAME][:bitrate=RATE], e.g. square:episode-square.mp4 (repeatable)")
+    parser.add_argument("--resume", action="store_true", help="Render in chunks that are kept until the video is complete, so running the same command again after a crash continues where it stopped")
+    parser.add_argument("--chunk-dir", help="Directory of the resumable chunks (default: the output path + .chunks)")
+    parser.add_argument("--draft", action="store_true", help=f"Render a quick draft: {DRAFT_DURATION}s at reduced size and frame rate")
+    parser.add_argument("--resolution", help=f"Output resolution, WIDTHxHEIGHT or one of {', '.join(RESOLUTIONS)} (default: the background image's size)")
+    parser.add_argument("--start", type=float, help="Start of the time window to render, in seconds")
+    parser.add_argument("--end", type=float, help="End of the time window to render, in seconds")
+    parser.add_argument("--window", action="append", default=[], type=parse_window, help="Render this time window, START-END in seconds or [HH:]MM:SS, to its own clip named after the output path with the clip number (repeatable)")
+    parser.add_argument("--startup-timing", action="store_true", help="Print how long the imports took at startup")
+    parser.add_argument("--events-log", help="Append the render's progress and timing events to this file as JSON lines")
 
     args = parser.parse_args()
+    if args.clear_cache:
+        RenderCache().clear()
+        print("Render cache cleared")
+        if not args.audio_path:
+            return 0
     args = prompt_for_missing_args(args)
 
-    generate_video(
+    window = None
+    if args.start is not None or args.end is not None:
+        start = args.start or 0.0
+        window = (start, args.end if args.end is not None else start + DRAFT_DURATION if args.draft else float('inf'))
+
+    ok = generate_video(
         args.audio_path,
         args.image_path,
         args.heading_text,
@@ -272,8 +837,21 @@ def main():
         args.heading_color,
         args.outline_color,
         args.wave_color,
-        args.output_path
+        args.output_path,
+        segments=args.segments,
+        workers=args.workers,
+        engine=args.engine,
+        cache=not args.no_cache,
+        events_path=args.events_log,
+        draft=args.draft,
+        window=window,
+        resolution=args.resolution,
+        resume=args.resume,
+        chunk_dir=args.chunk_dir,
+        variants=args.variant,
+        windows=args.window
     )
+    return 0 if ok else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,177 @@
+import functools
+
+import numpy as np
+
+# Size of the visualization canvas in pixels (the old 10x10 inch figure at 100 dpi)
+DEFAULT_SIZE = (1000, 1000)
+
+# Bar heights are drawn on a fixed radial scale, like ax.set_ylim(0, 80)
+VALUE_RANGE = (0.0, 80.0)
+BAR_ALPHA = 0.8
+
+# Default matplotlib subplot box (figure.subplot.left/right/bottom/top). The polar
+# axes is fitted into this box, so the numpy renderer uses it to place the circle
+# exactly where the matplotlib backend draws it.
+AXES_BOX = (0.125, 0.9, 0.11, 0.88)
+
+
+def polar_geometry(size):
+    """
+    Return (center_x, center_y, radius) in pixels of the polar axes for a canvas of the given size.
+    """
+    width, height = size
+    left, right, bottom, top = AXES_BOX
+    radius = min((right - left) * width, (top - bottom) * height) / 2
+    center_x = (left + right) / 2 * width
+    center_y = (1 - (bottom + top) / 2) * height
+    return center_x, center_y, radius
+
+
+class CircularBarRenderer:
+    """
+    Vectorized renderer for the circular bar visualization.
+
+    The polar geometry of the bar wedges is computed once as per-pixel lookup tables
+    (wedge index and radius) over the bounding box of the circle. Rendering a frame is
+    then a gather of the bar heights through the wedge table and a comparison with the
+    radius table, with no figure objects involved.
+    """
+
+    def __init__(self, wave_color, n_bars, size=DEFAULT_SIZE, value_range=VALUE_RANGE, alpha=BAR_ALPHA):
+        from PIL import ImageColor
+
+        self.n_bars = n_bars
+        self.size = tuple(size)
+        self.value_range = value_range
+        self.color = np.array(ImageColor.getrgb(wave_color)[:3], dtype=np.uint8)
+        self.alpha = alpha
+
+        width, height = self.size
+        center_x, center_y, radius = polar_geometry(self.size)
+        self.radius = radius
+
+        # Bounding box of the circle, clamped to the canvas
+        x0 = max(int(np.floor(center_x - radius)), 0)
+        x1 = min(int(np.ceil(center_x + radius)) + 1, width)
+        y0 = max(int(np.floor(center_y - radius)), 0)
+        y1 = min(int(np.ceil(center_y + radius)) + 1, height)
+        self.bbox = (x0, y0, x1, y1)
+
+        # Pixel centers relative to the circle center, y pointing up like the polar axes
+        xs = np.arange(x0, x1, dtype=np.float32) + 0.5 - center_x
+        ys = center_y - (np.arange(y0, y1, dtype=np.float32) + 0.5)
+        dx, dy = np.meshgrid(xs, ys)
+
+        r = np.hypot(dx, dy)
+        # Pixels outside the axes circle are never covered
+        r[r > radius + 0.5] = np.inf
+        self._r_lut = r.astype(np.float32)
+
+        # Bars are centered on their angle (ax.bar align='center'), so wedge k spans
+        # [theta_k - w/2, theta_k + w/2)
+        bar_width = 2 * np.pi / n_bars
+        theta = np.mod(np.arctan2(dy, dx) + bar_width / 2, 2 * np.pi)
+        self._bin_lut = np.minimum((theta / bar_width).astype(np.intp), n_bars - 1)
+
+        self._scale = np.float32(radius / (value_range[1] - value_range[0]))
+        # Work buffer of render_alpha, reused for every frame
+        self._coverage = np.empty(self._r_lut.shape, dtype=np.float32)
+
+    def bar_lengths(self, values):
+        """
+        Convert bar values to bar lengths in pixels, clipped to the visible value range.
+        """
+        values = np.asarray(values, dtype=np.float32)
+        low, high = self.value_range
+        return (np.clip(values, low, high) - np.float32(low)) * self._scale
+
+    def render_alpha(self, values, out=None):
+        """
+        Return the alpha channel (uint8) of the bounding box of the circle for one frame,
+        written into `out` if given.
+        """
+        lengths = self.bar_lengths(values)
+        # Radial coverage with a one pixel ramp for anti-aliased bar ends
+        coverage = np.take(lengths, self._bin_lut, out=self._coverage)
+        coverage -= self._r_lut
+        coverage += np.float32(0.5)
+        np.clip(coverage, 0, 1, out=coverage)
+        coverage *= np.float32(self.alpha * 255)
+        coverage += np.float32(0.5)
+        if out is None:
+            return coverage.astype(np.uint8)
+        np.copyto(out, coverage, casting='unsafe')
+        return out
+
+    def render(self, values, out=None):
+        """
+        Render one RGBA frame (uint8, height x width x 4) for the given bar values.
+
+        If `out` is given it must be a buffer previously returned by this renderer; only
+        the alpha channel inside the bounding box of the circle is rewritten.
+        """
+        width, height = self.size
+        if out is None:
+            out = np.zeros((height, width, 4), dtype=np.uint8)
+            out[..., :3] = self.color
+        x0, y0, x1, y1 = self.bbox
+        self.render_alpha(values, out[y0:y1, x0:x1, 3])
+        return out
+
+
+def render_bars_matplotlib(values, wave_color, n_bars, size=DEFAULT_SIZE):
+    """
+    Reference backend: draw one frame with a matplotlib polar bar chart and return it as RGBA.
+
+    This is the original figure-per-frame implementation, kept to diff the numpy renderer against.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    dpi = 100
+    fig, ax = plt.subplots(figsize=(size[0] / dpi, size[1] / dpi), dpi=dpi, subplot_kw=dict(projection='polar'))
+    angles = np.linspace(0, 2*np.pi, num=n_bars, endpoint=False)
+    ax.bar(angles, values, color=wave_color, alpha=BAR_ALPHA, width=2*np.pi/n_bars)
+
+    ax.set_ylim(*VALUE_RANGE)
+    ax.set_yticks([])
+    ax.set_xticks([])
+    ax.spines['polar'].set_visible(False)
+    fig.patch.set_alpha(0)
+    ax.set_facecolor('none')
+
+    fig.canvas.draw()
+    img = np.array(fig.canvas.buffer_rgba())
+    plt.close(fig)
+    return img
+
+
+class MatplotlibBarRenderer:
+    """
+    Renderer interface (render() and bbox) around the matplotlib reference backend.
+    """
+
+    def __init__(self, wave_color, n_bars, size=DEFAULT_SIZE):
+        self.n_bars = n_bars
+        self.size = tuple(size)
+        self.bbox = (0, 0, self.size[0], self.size[1])
+        self._render = functools.partial(render_bars_matplotlib, wave_color=wave_color, n_bars=n_bars, size=self.size)
+
+    def render(self, values, out=None):
+        return self._render(values)
+
+
+def make_bar_renderer(wave_color, n_bars, size=DEFAULT_SIZE, backend="numpy"):
+    """
+    Return a renderer whose render(values) maps a vector of bar values to an RGBA frame.
+
+    The renderer's bbox (x0, y0, x1, y1) is the part of the canvas frames can draw into.
+    backend is "numpy" (default) or "matplotlib" for the reference implementation.
+    """
+    if backend == "numpy":
+        return CircularBarRenderer(wave_color, n_bars, size)
+    if backend == "matplotlib":
+        return MatplotlibBarRenderer(wave_color, n_bars, size)
+    raise ValueError(f"Unknown visualization backend: {backend}")
+